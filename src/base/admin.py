@@ -1,13 +1,31 @@
 import locale
+from datetime import timedelta
 from typing import Any
 
-import openpyxl
+from admin_extra_buttons.api import ExtraButtonsMixin, button
 
 from django.contrib import admin
+from django.contrib.auth import get_permission_codename
+from django.core.exceptions import PermissionDenied
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db.models import CharField, OuterRef, Value
+from django.db.models.functions import Cast, Concat
 from django.db.models.query import QuerySet
-from django.http import HttpRequest, HttpResponse
-
-from base import models, forms
+from django.db import transaction
+from django.http import HttpRequest, HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.html import format_html
+
+from base import models, forms, exports, services
+from base.models import StockMovement
+from base.stock import lock_item_counts, record_movements
+from base.occupancy import occupancy_horizon
+from base.mixins.admin import ApproveMixin, ExportMixin, ItemSearchMixin
+from base.search import search_items
+from base.imports import IMPORTS
+from base.roles import get_roles, is_manager, is_storekeeper
 
 
 try:
@@ -86,13 +104,15 @@ class ItemImageInline(admin.TabularInline):
 
 class ItemBookingItemM2MInline(admin.TabularInline):
     model = models.ItemBookingItemM2M
+    formset = forms.ItemBookingItemFormSet
+    autocomplete_fields = ["item"]
     min_num = 1
     extra = 0
     validate_min = True
     
     class Media:
         js = (
-            "//ajax.googleapis.com/ajax/libs/jquery/3.4.1/jquery.min.js",
+            "admin/js/jquery.init.js",
             "admin/js/check_item_booking.js",
         )
 
@@ -119,6 +139,7 @@ class RefundImageInline(admin.TabularInline):
 
 class ItemRefundItemM2MInline(admin.TabularInline):
     model = models.ItemRefundItemM2M
+    autocomplete_fields = ["item"]
     min_num = 1
     extra = 0
     validate_min = True
@@ -144,16 +165,51 @@ class ClientAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.Storage)
-class StorageAdmin(admin.ModelAdmin):
-    list_display = ["name", "free_area", "area"]
+class StorageAdmin(ExtraButtonsMixin, admin.ModelAdmin):
+    list_display = ["name", "free_area", "area", "occupancy_link"]
     exclude = ["id"]
     search_fields = ["name", "clients"]
     
+    @admin.display(description="Занятость")
+    def occupancy_link(self, obj):
+        return format_html(
+            '<a href="{}">Календарь</a>',
+            reverse("admin:base_storage_occupancy", args=[obj.pk]),
+        )
+    
+    @button(label="Календарь занятости", change_form=True)
+    def occupancy(self, request, pk):
+        storage = get_object_or_404(self.get_queryset(request), pk=pk)
+        start, end = occupancy_horizon()
+        grid = dict(
+            (row.date, row)
+            for row in storage.occupancy.filter(date__range=(start, end))
+        )
+        days = []
+        day = start
+        while day <= end:
+            row = grid.get(day)
+            booked_area = row.booked_area if row else 0
+            days.append({
+                "date": day,
+                "booked_count": row.booked_count if row else 0,
+                "booked_area": booked_area,
+                "percent": round(booked_area * 100 / storage.area) if storage.area else None,
+            })
+            day += timedelta(days=1)
+        return TemplateResponse(request, "admin/base/storage/occupancy.html", {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "original": storage,
+            "title": f"Занятость склада {storage.name}",
+            "days": days,
+        })
+    
     def get_queryset(self, request: HttpRequest) -> QuerySet:
-        if request.user.groups.filter(name="Кладовщик").exists():
-            queryset = request.user.storages.all()
-            return queryset
-        return super().get_queryset(request)
+        queryset = super().get_queryset(request)
+        if is_storekeeper(request):
+            return queryset.filter(pk__in=get_roles(request)["storages"])
+        return queryset
 
 
 @admin.register(models.Project)
@@ -177,45 +233,53 @@ class ItemStatusAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.Item)
-class ItemAdmin(admin.ModelAdmin):
-    list_display = ["article", "name", "category", "count", "is_booked"]
+class ItemAdmin(ExtraButtonsMixin, ExportMixin, admin.ModelAdmin):
+    list_display = ["article", "name", "category", "count", "is_booked", "booked_count", "active_booking_count"]
+    list_select_related = ["category"]
+    list_filter = ["is_booked"]
     exclude = ["id"]
     search_fields = ["article", "name"]
-    readonly_fields = ["article", "is_booked", "booking_projects", "booking_quantities", "booking_periods"]
+    # Stable pages for the item autocomplete
+    ordering = ["article"]
+    readonly_fields = ["article", "is_booked", "booked_count", "active_booking_count", "booking_projects", "booking_quantities", "booking_periods"]
     inlines = [ItemImageInline]
-    actions = ["export_as_xlsx"]
+    export_class = exports.ItemExport
+    
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        # Ranked for the autocomplete, the changelist applies its own ordering
+        return search_items(queryset, search_term), False
+    
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_dbfield(db_field, request, **kwargs)
+        if db_field.name == "count":
+            # Changed is judged against the count shown, not the one at saving
+            formfield.show_hidden_initial = True
+        return formfield
+    
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            record_movements([StockMovement(item=obj, kind="opening", quantity=obj.count)], apply=False)
+            return
+        # The count is never written from the form: approvals may have moved it
+        # since the form was loaded. An edit becomes an adjustment against the
+        # locked current count, applied like any other movement.
+        count = obj.count
+        obj.save(update_fields=[
+            field.name for field in obj._meta.concrete_fields
+            if not field.primary_key and field.name != "count"
+        ])
+        if "count" in form.changed_data:
+            current = lock_item_counts([obj.pk])[obj.pk]
+            record_movements([StockMovement(item=obj, kind="adjustment", quantity=count - current)])
+            obj.count = count
+    
+    @button(label="Загрузить из файла", change_list=True)
+    def import_items(self, request):
+        return HttpResponseRedirect(f"{reverse('admin:base_importjob_add')}?model=base.item")
     
-    def export_as_xlsx(self, request, queryset):
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "Товары"
-
-        headers = ['Артикул', 'Название', 'Категория', 'Количество на складе', 'Забронирован?', 'Периоды броней']
-        sheet.append(headers)
-
-        for obj in queryset:
-            bookings = models.ItemBooking.objects.filter(items=obj)
-            periods = ", ".join(
-                f"{booking.start_date.strftime('%d.%m.%Y')}-{booking.end_date.strftime('%d.%m.%Y')}" 
-                for booking in bookings
-            )
-            sheet.append([
-                obj.article,
-                obj.name,
-                obj.category.name if obj.category else None,
-                obj.count,
-                'Да' if obj.is_booked else 'Нет',
-                periods or "Нет броннирований",
-            ])
-
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=товары.xlsx'
-
-        workbook.save(response)
-        return response
-
-    export_as_xlsx.short_description = "Выгрузить .XLSX"
-
     @admin.display(description="Проекты")
     def booking_projects(self, obj):
         projects = obj.bookings.values_list('project__name', flat=True).distinct()
@@ -236,37 +300,24 @@ class ItemAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.ItemStock)
-class AdminItemStock(admin.ModelAdmin):
+class AdminItemStock(ExtraButtonsMixin, ItemSearchMixin, ApproveMixin, ExportMixin, admin.ModelAdmin):
     list_display = ["article_display", "client_display", "storage_display", "count", "is_archived"]
+    list_select_related = [
+        "existing_item__client", "existing_item__project__client", "existing_item__storage",
+        "new_item_client", "new_item_storage",
+    ]
     list_filter = ('request_type', "is_archived")
-    search_fields = ('new_item_name', 'existing_item__name')
+    search_fields = ('new_item_name',)
+    item_search_path = "existing_item"
+    autocomplete_fields = ["existing_item"]
     inlines = [ItemImageInline]
-    actions = ["export_as_xlsx"]
+    export_class = exports.ItemStockExport
+    actions = ExportMixin.actions + ["approve_selected"]
+    approve_function = staticmethod(services.approve_stocks)
     
-    def export_as_xlsx(self, request, queryset):
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "Заявки на приход"
-
-        headers = ["Товар", "Проект", "Дата прихода"]
-        sheet.append(headers)
-
-        for obj in queryset:
-            sheet.append([
-                f"{obj.new_item_name} ({obj.new_item_count}шт.) {obj.new_item_storage.name}"
-                if obj.new_item_name
-                else f"{obj.existing_item.name} ({obj.count}шт.) {obj.existing_item.storage.name}",
-                obj.existing_item.project.name if obj.existing_item and obj.existing_item.project else obj.new_item_project,
-                obj.date.strftime('%d.%m.%Y'),
-            ])
-
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=товары.xlsx'
-
-        workbook.save(response)
-        return response
-
-    export_as_xlsx.short_description = "Выгрузить .XLSX"
+    @button(label="Загрузить накладную", change_list=True)
+    def import_stocks(self, request):
+        return HttpResponseRedirect(f"{reverse('admin:base_importjob_add')}?model=base.itemstock")
     
     @admin.display(description="Клиент")
     def client_display(self, obj):
@@ -297,7 +348,7 @@ class AdminItemStock(admin.ModelAdmin):
         if obj and obj.is_approved:
             return [field.name for field in obj._meta.fields]
         
-        if request.user.groups.filter(name="Кладовщик").exists():
+        if is_storekeeper(request):
             fields = [
                 "request_type", "existing_item", #"count",
                 "new_item_name", "new_item_description",
@@ -325,55 +376,27 @@ class AdminItemStock(admin.ModelAdmin):
 
 
 @admin.register(models.ItemBooking)
-class AdminItemBooking(admin.ModelAdmin):
-    list_display = ('project', 'city', 'is_approved', 'booking_items', 'booking_quantities', 'booking_periods', "is_archived")
+class AdminItemBooking(ItemSearchMixin, ApproveMixin, ExportMixin, admin.ModelAdmin):
+    list_display = ('project', 'city', 'is_approved', 'booking_items', 'booking_quantities', 'booking_periods', "is_closed", "is_archived")
     form = forms.BookingAdminForm
     exclude = ["id"]
-    search_fields = ["project__name", "items__name", "start_date__month"] # TODO: add month
+    search_fields = ["project__name", "start_date__month"] # TODO: add month
+    item_search_path = "items"
     inlines = [ItemBookingItemM2MInline]
-    list_filter = ["is_archived"]
-    actions = ["export_as_xlsx"]
+    list_filter = ["is_closed", "is_archived"]
+    export_class = exports.ItemBookingExport
+    actions = ExportMixin.actions + ["approve_selected"]
+    approve_function = staticmethod(services.approve_bookings)
     
-    def export_as_xlsx(self, request, queryset):
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "Заявки на бронь"
-
-        headers = ["Товары", "Проект", "Город", "Начальная дата", "Конечная дата"]
-        sheet.append(headers)
-
-        for obj in queryset:
-            items = obj.items.all()
-            items_data = ", ".join(
-                f"{item.article} | {item.name} ({item.count}шт.) [{item.storage.name if item.storage else 'Склад не указан'}]"
-                for item in items
-            )
-            sheet.append([
-                items_data,
-                obj.project.name if obj.project else None,
-                obj.city,
-                obj.start_date.strftime('%d.%m.%Y'),
-                obj.end_date.strftime('%d.%m.%Y'),
-            ])
-
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=товары.xlsx'
-
-        workbook.save(response)
-        return response
-
-    export_as_xlsx.short_description = "Выгрузить .XLSX"
+    list_select_related = ["project__client"]
     
     @admin.display(description="Товары")
     def booking_items(self, obj):
-        items = obj.items.values_list('name', flat=True)
-        return ", ".join(items) if items else "—"
+        return ", ".join(obj.item_names) if obj.item_names else "—"
 
     @admin.display(description="Количество")
     def booking_quantities(self, obj):
-        booking_items = models.ItemBookingItemM2M.objects.filter(booking=obj)
-        quantities = [f"{bi.item.name}: {bi.item_count}" for bi in booking_items]
-        return ", ".join(quantities) if quantities else "—"
+        return ", ".join(obj.item_quantities) if obj.item_quantities else "—"
 
     @admin.display(description="Периоды брони")
     def booking_periods(self, obj):
@@ -382,7 +405,7 @@ class AdminItemBooking(admin.ModelAdmin):
         return f"{start_date} - {end_date}"
     
     def get_readonly_fields(self, request: HttpRequest, obj: Any | None = ...) -> list[str] | tuple[Any, ...]:
-        if request.user.groups.filter(name="Кладовщик").exists():
+        if is_storekeeper(request):
             fields = [
                 "items", "project", "date",
                 "city", "description", "start_date",
@@ -394,51 +417,38 @@ class AdminItemBooking(admin.ModelAdmin):
     
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.order_by("is_archived")
+        lines = models.ItemBookingItemM2M.objects.filter(booking=OuterRef("pk")).order_by("pk")
+        return qs.annotate(
+            item_names=ArraySubquery(lines.values("item__name")),
+            item_quantities=ArraySubquery(lines.values(
+                quantity=Concat("item__name", Value(": "), Cast("item_count", CharField())),
+            )),
+        ).order_by("is_archived")
     
     
 @admin.register(models.ItemRecovery)
-class AdminItemRecovery(admin.ModelAdmin):
+class AdminItemRecovery(ItemSearchMixin, ApproveMixin, ExportMixin, admin.ModelAdmin):
     list_display = ["item", "count", "item__storage", "planning_date", "is_ceo_approved", "is_approved", "is_archived"]
+    list_select_related = ["item__storage"]
     exclude = ["id"]
     search_fields = ["item__article", "item__name"]
+    item_search_path = "item"
+    autocomplete_fields = ["item"]
     inlines = [RecoveryImageInline]
     list_filter = ["is_archived"]
-    actions = ["export_as_xlsx"]
-    
-    def export_as_xlsx(self, request, queryset):
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "Заявки на утилизацию"
-
-        headers = ["Товар", "Количество", "Планируемая дата", "Подтверждение утилизации кладовщиком"]
-        sheet.append(headers)
-
-        for obj in queryset:
-            sheet.append([
-                f"{obj.item.article} | {obj.item.name}",
-                obj.item.count,
-                obj.planning_date.strftime("%d.%m.%Y"),
-                "Да" if obj.is_approved else "Нет",
-            ])
-
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=товары.xlsx'
-
-        workbook.save(response)
-        return response
-
-    export_as_xlsx.short_description = "Выгрузить .XLSX"
+    export_class = exports.ItemRecoveryExport
+    actions = ExportMixin.actions + ["approve_selected"]
+    approve_function = staticmethod(services.approve_recoveries)
     
     def get_readonly_fields(self, request: HttpRequest, obj: Any | None = ...) -> list[str] | tuple[Any, ...]:
-        if request.user.groups.filter(name="Кладовщик").exists():
+        if is_storekeeper(request):
             fields = [
                 "item", "reason", "planning_date",
                 "description", "status", "is_ceo_approved",
                 "is_archived",
             ]
             return fields
-        elif request.user.groups.filter(name="Руководитель").exists():
+        elif is_manager(request):
             return ["is_approved", "date", "is_archived",]
         else:
             return ["is_approved", "is_ceo_approved", "date", "is_archived",]
@@ -449,49 +459,25 @@ class AdminItemRecovery(admin.ModelAdmin):
 
     
 @admin.register(models.ItemRefund)
-class AdminItemRefund(admin.ModelAdmin):
+class AdminItemRefund(ItemSearchMixin, ApproveMixin, ExportMixin, admin.ModelAdmin):
     exclude = ["id"]
     search_fields = ["items__article", "items__name"]
+    item_search_path = "items"
     inlines = [ItemRefundItemM2MInline, RefundImageInline]
     list_display = ["project__name", "project__client", "city", "date", "storages_display", "is_archived"]
     list_filter = ["is_archived"]
-    actions = ["export_as_xlsx"]
+    export_class = exports.ItemRefundExport
+    actions = ExportMixin.actions + ["approve_selected"]
+    approve_function = staticmethod(services.approve_refunds)
     
-    def export_as_xlsx(self, request, queryset):
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "Заявки на возврат"
-
-        headers = ["Товары", "Проект", "Город (откуда едет)", "Дата прихода"]
-        sheet.append(headers)
-
-        for obj in queryset:
-            items = obj.items.all()
-            items_data = ", ".join(
-                f"{item.article} | {item.name} ({item.count}шт.) [{item.storage.name if item.storage else 'Склад не указан'}]"
-                for item in items
-            )
-            sheet.append([
-                items_data,
-                obj.project.name,
-                obj.city,
-                obj.date.strftime('%d.%m.%Y'),
-            ])
-
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=товары.xlsx'
-
-        workbook.save(response)
-        return response
-
-    export_as_xlsx.short_description = "Выгрузить .XLSX"
+    list_select_related = ["project__client"]
     
     @admin.display(description="Склады")
     def storages_display(self, obj):
-        return " | ".join(set([item.storage.name for item in obj.items.all()]))
+        return " | ".join(obj.storage_names)
     
     def get_readonly_fields(self, request: HttpRequest, obj: Any | None = ...) -> list[str] | tuple[Any, ...]:
-        if request.user.groups.filter(name="Кладовщик").exists():
+        if is_storekeeper(request):
             fields = [
                 "items", "project", #"description",
                 "is_archived",
@@ -503,46 +489,25 @@ class AdminItemRefund(admin.ModelAdmin):
     
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.order_by("is_archived")
+        storages = (
+            models.ItemRefundItemM2M.objects.filter(refund=OuterRef("pk"), item__storage__isnull=False)
+            .order_by("item__storage__name").values("item__storage__name").distinct()
+        )
+        return qs.annotate(storage_names=ArraySubquery(storages)).order_by("is_archived")
     
 
 @admin.register(models.ItemConsumption)
-class AdminItemConsumption(admin.ModelAdmin):
+class AdminItemConsumption(ItemSearchMixin, ApproveMixin, ExportMixin, admin.ModelAdmin):
     list_display = ["booking__project__name", "booking__project__client", "city", "date_display", "storage_display", "is_archived"]
+    list_select_related = ["booking__project__client"]
     exclude = ["id"]
-    search_fields = ["booking__items__article", "booking__items__name", "date__month"]
+    search_fields = ["date__month"]
+    item_search_path = "booking__items"
     inlines = [ItemConsumptionImageInline]
     list_filter = ["is_archived"]
-    actions = ["export_as_xlsx"]
-    
-    def export_as_xlsx(self, request, queryset):
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "Заявки на расход"
-
-        headers = ["Товары", "Проект", "Город (куда едет)", "Дата отправки"]
-        sheet.append(headers)
-
-        for obj in queryset:
-            items = obj.booking.items.all()
-            items_data = ", ".join(
-                f"{item.article} | {item.name} ({item.count}шт.) [{item.storage.name if item.storage else 'Склад не указан'}]"
-                for item in items
-            )
-            sheet.append([
-                items_data,
-                obj.booking.project.name if obj.booking.project else None,
-                obj.city,
-                obj.date.strftime('%d.%m.%Y'),
-            ])
-
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=товары.xlsx'
-
-        workbook.save(response)
-        return response
-
-    export_as_xlsx.short_description = "Выгрузить .XLSX"
+    export_class = exports.ItemConsumptionExport
+    actions = ExportMixin.actions + ["approve_selected"]
+    approve_function = staticmethod(services.approve_consumptions)
     
     @admin.display(description="Дата отправки")
     def date_display(self, obj):
@@ -550,11 +515,10 @@ class AdminItemConsumption(admin.ModelAdmin):
     
     @admin.display(description="Склады")
     def storage_display(self, obj):
-        storages = set([item.storage.name for item in obj.booking.items.all()])
-        return ", ".join(storages)
+        return ", ".join(obj.storage_names)
     
     def get_readonly_fields(self, request: HttpRequest, obj: Any | None = ...) -> list[str] | tuple[Any, ...]:
-        if request.user.groups.filter(name="Кладовщик").exists():
+        if is_storekeeper(request):
             return [
                 "booking", "date_created", "is_archived", #"description",
             ]
@@ -563,6 +527,143 @@ class AdminItemConsumption(admin.ModelAdmin):
     
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.order_by("is_archived")
+        storages = (
+            models.ItemBookingItemM2M.objects.filter(booking=OuterRef("booking_id"), item__storage__isnull=False)
+            .order_by("item__storage__name").values("item__storage__name").distinct()
+        )
+        return qs.annotate(storage_names=ArraySubquery(storages)).order_by("is_archived")
+
+
+@admin.register(models.ExportJob)
+class AdminExportJob(admin.ModelAdmin):
+    list_display = ["__str__", "model", "format", "progress_display", "date_created", "date_finished", "download_link"]
+    list_filter = ["status"]
+    exclude = ["query"]
+    readonly_fields = [
+        "user", "model", "format", "status", "progress", "total",
+        "file", "error", "date_created", "date_finished",
+    ]
+    
+    @admin.display(description="Прогресс")
+    def progress_display(self, obj):
+        return f"{obj.progress}/{obj.total}"
+    
+    @admin.display(description="Файл")
+    def download_link(self, obj):
+        if obj.status != "done" or not obj.file:
+            return "—"
+        return format_html(
+            '<a href="{}">Скачать</a>',
+            reverse("download_export", args=[obj.id]),
+        )
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    # Every staff user sees the jobs they started (see get_queryset)
+    def has_view_permission(self, request, obj=None):
+        return request.user.is_staff
+    
+    def has_module_permission(self, request):
+        return request.user.is_staff
+    
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        if request.user.is_superuser:
+            return qs
+        return qs.filter(user=request.user)
+
+
+@admin.register(models.ImportJob)
+class AdminImportJob(admin.ModelAdmin):
+    list_display = ["__str__", "model", "progress", "created", "date_created", "date_finished"]
+    list_filter = ["status"]
+    form = forms.ImportJobForm
+    
+    def get_import_models(self, request):
+        """The IMPORTS the user may run: those creating rows the user can add."""
+        return [
+            label for label, import_class in IMPORTS.items()
+            if request.user.has_perm(
+                f"{import_class.model._meta.app_label}.{get_permission_codename('add', import_class.model._meta)}"
+            )
+        ]
+    
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        if obj is None:
+            form = type(form.__name__, (form,), {"import_models": self.get_import_models(request)})
+        return form
+    
+    def get_fields(self, request, obj=None):
+        if obj is None:
+            if request.user.is_superuser or is_storekeeper(request):
+                return ["model", "file", "approve"]
+            return ["model", "file"]
+        return [
+            "user", "model", "approve", "file", "status", "progress", "created",
+            "errors", "date_created", "date_finished",
+        ]
+    
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return []
+        return self.get_fields(request, obj)
     
-    
\ No newline at end of file
+    def get_changeform_initial_data(self, request):
+        return {"model": request.GET.get("model", "base.item")}
+    
+    def save_model(self, request, obj, form, change):
+        from base.tasks import run_import_job
+        
+        if obj.model not in self.get_import_models(request):
+            raise PermissionDenied
+        obj.user = request.user
+        super().save_model(request, obj, form, change)
+        transaction.on_commit(lambda: run_import_job.delay(obj.pk))
+    
+    def has_add_permission(self, request):
+        return bool(self.get_import_models(request))
+    
+    def has_change_permission(self, request, obj=None):
+        return obj is None and super().has_change_permission(request, obj)
+    
+    # Every staff user sees the jobs they started (see get_queryset)
+    def has_view_permission(self, request, obj=None):
+        return request.user.is_staff
+    
+    def has_module_permission(self, request):
+        return request.user.is_staff
+    
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        if request.user.is_superuser:
+            return qs
+        return qs.filter(user=request.user)
+
+
+@admin.register(models.ExportCheckpoint)
+class AdminExportCheckpoint(admin.ModelAdmin):
+    list_display = ["consumer", "model", "date_exported"]
+    search_fields = ["consumer"]
+
+
+@admin.register(models.StockMovement)
+class AdminStockMovement(admin.ModelAdmin):
+    list_display = ["item", "kind", "quantity", "date", "date_created"]
+    list_filter = ["kind", "date"]
+    search_fields = ["item__article", "item__name"]
+    list_select_related = ["item"]
+    raw_id_fields = ["item", "stock", "consumption", "refund", "recovery"]
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,40 @@
+from django.db import connection
+
+
+# article = (n * ARTICLE_MULTIPLIER + ARTICLE_OFFSET) mod ARTICLE_SPACE maps the
+# sequence values one-to-one onto the articles (the multiplier is coprime with
+# the space), so consecutive items do not get guessable consecutive articles.
+ARTICLE_SPACE = 1_000_000
+ARTICLE_MULTIPLIER = 738_137
+ARTICLE_OFFSET = 271_828
+
+ALLOCATE_SQL = """
+    SELECT candidate.article
+    FROM (
+        SELECT lpad(
+            ((nextval('base_item_article_seq') * %(multiplier)s + %(offset)s) %% %(space)s)::text,
+            6, '0'
+        ) AS article
+        FROM generate_series(1, %(count)s)
+    ) AS candidate
+    WHERE NOT EXISTS (SELECT 1 FROM base_item WHERE article = candidate.article)
+"""
+
+
+def allocate_articles(count):
+    """
+    Returns `count` new unique articles, drawn from the base_item_article_seq
+    sequence in one query. Articles already taken (assigned at random before
+    the sequence existed) are skipped and drawn again.
+    """
+    articles = []
+    with connection.cursor() as cursor:
+        while len(articles) < count:
+            cursor.execute(ALLOCATE_SQL, {
+                "multiplier": ARTICLE_MULTIPLIER,
+                "offset": ARTICLE_OFFSET,
+                "space": ARTICLE_SPACE,
+                "count": count - len(articles),
+            })
+            articles += [article for article, in cursor.fetchall()]
+    return articles
@@ -0,0 +1,199 @@
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.utils import OperationalError
+from django.db.transaction import TransactionManagementError
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+
+AVAILABILITY_SQL = """
+    SELECT item.article, day::date, item.count - COALESCE(SUM(line.item_count), 0)
+    FROM base_item AS item
+    CROSS JOIN generate_series(%(start)s::date, %(end)s::date, interval '1 day') AS day
+    LEFT JOIN base_itembookingitemm2m AS line
+        ON line.item_id = item.article
+        AND line.period && daterange(%(start)s::date, %(end)s::date, '[]')
+        AND line.period @> day::date
+        AND line.booking_id IS DISTINCT FROM %(exclude)s
+        AND NOT EXISTS (
+            SELECT 1 FROM base_itemconsumption AS consumption
+            WHERE consumption.booking_id = line.booking_id AND consumption.is_approved
+        )
+    WHERE item.article = ANY(%(items)s)
+    GROUP BY item.article, day
+    ORDER BY item.article, day
+"""
+
+
+def available_quantities(items, start, end, exclude_booking=None):
+    """
+    Returns {article: {day: quantity}}: the stock of every item minus the
+    quantities of the bookings (pending or approved, not yet consumed)
+    covering the day, for each day from `start` to `end` inclusive.
+    One query over the GiST index on (item, period).
+    """
+    result = defaultdict(dict)
+    with connection.cursor() as cursor:
+        cursor.execute(AVAILABILITY_SQL, {
+            "items": list(items),
+            "start": start,
+            "end": end,
+            "exclude": exclude_booking,
+        })
+        for article, day, quantity in cursor.fetchall():
+            result[article][day] = quantity
+    return result
+
+
+def min_available(item, start, end, exclude_booking=None):
+    """The quantity of `item` that can be booked for the whole period."""
+    days = available_quantities([item], start, end, exclude_booking)[item]
+    return min(days.values(), default=0)
+
+
+RESERVATION_LOCK_TIMEOUT = "3s"
+
+LOCK_ITEMS_SQL = "SELECT article FROM base_item WHERE article = ANY(%s) ORDER BY article FOR UPDATE"
+
+
+def reserve_items(quantities, start, end, exclude_booking=None):
+    """
+    Checks that `quantities` ({article: quantity}) can be booked from
+    `start` to `end` while holding row locks on the items until the
+    enclosing transaction ends (required), so concurrent bookings of the same items
+    are checked one after another. Items are locked in article order (no
+    deadlocks); a lock not granted within RESERVATION_LOCK_TIMEOUT, like a
+    shortage, raises ValidationError.
+    """
+    quantities = {article: quantity for article, quantity in quantities.items() if quantity}
+    if not quantities:
+        return
+    if not connection.in_atomic_block:
+        # The locks would be released before the booking is saved
+        raise TransactionManagementError("reserve_items cannot be used outside of a transaction.")
+    # A savepoint: a lock timeout must not break the enclosing transaction
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"SET LOCAL lock_timeout = '{RESERVATION_LOCK_TIMEOUT}'")
+        try:
+            cursor.execute(LOCK_ITEMS_SQL, [sorted(quantities)])
+        except OperationalError:
+            raise ValidationError("Эти товары сейчас бронируются в другой заявке, попробуйте ещё раз.")
+        cursor.execute("SET LOCAL lock_timeout TO DEFAULT")
+
+        available = available_quantities(quantities, start, end, exclude_booking)
+    errors = []
+    for article, quantity in sorted(quantities.items()):
+        days = available.get(article, {})
+        if quantity > min(days.values(), default=0):
+            errors.append(
+                f"Товар {article}: запрошено {quantity}, доступно на период брони "
+                f"{max(min(days.values(), default=0), 0)}"
+            )
+    if errors:
+        raise ValidationError(errors)
+
+
+AVAILABILITY_CACHE_TIMEOUT = 60 * 60 * 24
+
+ITEMS_SQL = "SELECT article, count FROM base_item WHERE article = ANY(%s)"
+
+BOOKING_LINES_SQL = """
+    SELECT line.item_id, line.booking_id, lower(line.period), upper(line.period) - 1,
+        line.item_count, booking.is_approved
+    FROM base_itembookingitemm2m AS line
+    JOIN base_itembooking AS booking ON booking.id = line.booking_id
+    WHERE line.item_id = ANY(%s)
+        AND line.period IS NOT NULL
+        AND NOT EXISTS (
+            SELECT 1 FROM base_itemconsumption AS consumption
+            WHERE consumption.booking_id = line.booking_id AND consumption.is_approved
+        )
+"""
+
+
+def availability_generation_key(article):
+    return f"availability:generation:{article}"
+
+
+def get_availability_keys(articles):
+    """
+    {state cache key: article}. Keys carry the item's current generation
+    token, so a state loaded before an invalidation and stored after it
+    is written under a key nobody reads any more.
+    """
+    generation_keys = {availability_generation_key(article): article for article in articles}
+    generations = cache.get_many(list(generation_keys))
+    missing = {key: uuid.uuid4().hex for key in generation_keys if key not in generations}
+    if missing:
+        for key, generation in missing.items():
+            cache.add(key, generation, timeout=None)
+        generations.update(cache.get_many(list(missing)))
+    return {
+        f"availability:item:{article}:{generations.get(key, missing.get(key))}": article
+        for key, article in generation_keys.items()
+    }
+
+
+def load_item_states(articles):
+    """
+    Returns {article: {"stock": count, "lines": [(booking_id, start, end, count, is_approved)]}}
+    for the existing items, with the booking lines counted by available_quantities.
+    """
+    articles = list(articles)
+    with connection.cursor() as cursor:
+        cursor.execute(ITEMS_SQL, [articles])
+        states = {article: {"stock": count, "lines": []} for article, count in cursor.fetchall()}
+        cursor.execute(BOOKING_LINES_SQL, [list(states)])
+        for article, *line in cursor.fetchall():
+            states[article]["lines"].append(tuple(line))
+    return states
+
+
+def get_item_states(articles):
+    """load_item_states served from the cache; misses are loaded together and cached."""
+    keys = get_availability_keys(articles)
+    states = {keys[key]: state for key, state in cache.get_many(list(keys)).items()}
+    missing = [article for article in keys.values() if article not in states]
+    if missing:
+        loaded = load_item_states(missing)
+        cache.set_many(
+            {key: loaded[article] for key, article in keys.items() if article in loaded},
+            AVAILABILITY_CACHE_TIMEOUT,
+        )
+        states.update(loaded)
+    return states
+
+
+def invalidate_availability(articles):
+    """
+    Gives `articles` new generation tokens once the transaction commits,
+    which drops their cached states (see get_availability_keys).
+    """
+    keys = [availability_generation_key(article) for article in set(articles)]
+    if keys:
+        transaction.on_commit(
+            lambda: cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+        )
+
+
+def cached_available_quantities(states, start, end, exclude_booking=None):
+    """available_quantities computed from get_item_states results."""
+    result = {}
+    for article, state in states.items():
+        lines = [
+            (line_start, line_end, count)
+            for booking_id, line_start, line_end, count, is_approved in state["lines"]
+            if booking_id != exclude_booking and line_start <= end and line_end >= start
+        ]
+        days = {}
+        day = start
+        while day <= end:
+            days[day] = state["stock"] - sum(
+                count for line_start, line_end, count in lines if line_start <= day <= line_end
+            )
+            day += timedelta(days=1)
+        result[article] = days
+    return result
@@ -0,0 +1,47 @@
+import threading
+
+from django.db import connection, transaction
+
+
+class CommitBatch:
+    """
+    Values collected over a transaction and passed to `flush` once, when it
+    commits. The flush is registered with transaction.on_commit by the first
+    `add` of the transaction and a thread-local flag records that. The flag
+    outlives a rollback, so the transaction also sets a transaction-local
+    setting, which a rollback (including to a savepoint) clears together
+    with the discarded callback: the next `add` then starts a new batch.
+    """
+    def __init__(self, name, flush):
+        self.setting = f"base.{name}_scheduled"
+        self.flush = flush
+        self.local = threading.local()
+
+    @property
+    def values(self):
+        return getattr(self.local, "values", [])
+
+    def is_scheduled(self):
+        if not getattr(self.local, "scheduled", False):
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting(%s, true)", [self.setting])
+            return cursor.fetchone()[0] == "on"
+
+    def add(self, *values):
+        scheduled = self.is_scheduled()
+        if not scheduled:
+            # Anything collected before belongs to a rolled back transaction
+            self.local.values = []
+        self.local.values.extend(values)
+        if not scheduled:
+            self.local.scheduled = True
+            if not transaction.get_autocommit():
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT set_config(%s, 'on', true)", [self.setting])
+            transaction.on_commit(self.run)
+
+    def run(self):
+        values = self.local.values
+        del self.local.values, self.local.scheduled
+        self.flush(values)
@@ -0,0 +1,507 @@
+import io
+import os
+import csv
+import uuid
+import hashlib
+import tempfile
+from pathlib import Path
+from datetime import timedelta
+from itertools import chain, islice
+
+import openpyxl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models import Manager, Q
+from django.utils.timezone import now
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+from base import models
+
+
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Rows fetched from the database per round trip while exporting
+EXPORT_CHUNK_SIZE = 2000
+
+# Delta exports re-send rows changed shortly before the previous checkpoint,
+# so rows saved while that export was running are not lost
+EXPORT_DELTA_OVERLAP = timedelta(minutes=5)
+
+
+def format_date(value, date_format="%d.%m.%Y"):
+    return value.strftime(date_format) if value else None
+
+
+def format_bool(value):
+    return "Да" if value else "Нет"
+
+
+def format_items(items):
+    return ", ".join(
+        f"{item.article} | {item.name} ({item.count}шт.) [{item.storage.name if item.storage else 'Склад не указан'}]"
+        for item in items
+    )
+
+
+def parquet_type(values):
+    """Arrow type inferred from a chunk of column values; all-empty columns are stored as strings."""
+    arrow_type = pa.array(values).type
+    return pa.string() if pa.types.is_null(arrow_type) else arrow_type
+
+
+class Echo:
+    """File-like object returning what is written, used to stream csv.writer output."""
+    def write(self, value):
+        return value
+
+
+class Column:
+    """
+    A single export column.
+
+    `source` is either a dotted attribute path ("booking.project.name",
+    to-many relations resolve to their `.all()`) or a callable taking the object.
+    `related` lists extra ORM lookups the column reads (e.g. "items__storage"),
+    `annotation` is an expression annotated on the queryset under `source`.
+    """
+    def __init__(self, header, source, related=(), format=None, annotation=None):
+        self.header = header
+        self.source = source
+        self.related = list(related)
+        self.format = format
+        self.annotation = annotation
+
+    def get_lookups(self):
+        if callable(self.source) or self.annotation is not None:
+            return self.related
+        return [self.source.replace(".", "__"), *self.related]
+
+    def get_value(self, obj):
+        if callable(self.source):
+            value = self.source(obj)
+        else:
+            value = obj
+            for attr in self.source.split("."):
+                value = getattr(value, attr, None)
+                if value is None:
+                    break
+            if isinstance(value, Manager):
+                value = value.all()
+        if self.format:
+            value = self.format(value)
+        return value
+
+
+def iter_relations(model, lookup):
+    """Yields the relation fields traversed by an ORM lookup, stopping at the first non-relation."""
+    for name in lookup.split("__"):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return
+        if not field.is_relation:
+            return
+        yield field
+        model = field.related_model
+
+
+def plan_related(model, lookups):
+    """
+    Splits ORM lookups into `select_related` and `prefetch_related` paths.
+    Each lookup is followed while it traverses relations; once a to-many
+    relation is crossed the rest of the path has to be prefetched.
+    """
+    select_related, prefetch_related = set(), set()
+    for lookup in lookups:
+        path, many = [], False
+        for field in iter_relations(model, lookup):
+            path.append(field.name)
+            many = many or field.many_to_many or field.one_to_many
+        if path:
+            (prefetch_related if many else select_related).add("__".join(path))
+    # "items" is already covered by "items__storage"
+    prefetch_related = {
+        lookup for lookup in prefetch_related
+        if not any(other.startswith(f"{lookup}__") for other in prefetch_related)
+    }
+    return sorted(select_related), sorted(prefetch_related)
+
+
+def has_field(model, name):
+    try:
+        model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    return True
+
+
+def get_export_generation(label):
+    """
+    Random token identifying the current state of a model's rows.
+    A token (not a counter) keeps fingerprints unique even if the cache key is evicted.
+    """
+    key = f"export:generation:{label}"
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_export_generation(model):
+    """
+    Replaces the generation once the transaction commits: an export
+    running in between must not cache the old rows under the new token.
+    """
+    key = f"export:generation:{model._meta.label_lower}"
+    transaction.on_commit(lambda: cache.set(key, uuid.uuid4().hex, timeout=None))
+
+
+def evict_export_cache():
+    """Removes least recently used cached files until the cache fits EXPORT_CACHE_MAX_SIZE."""
+    files = []
+    for path in Path(settings.EXPORT_CACHE_ROOT).glob("*.*"):
+        if path.suffix == ".tmp":
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= settings.EXPORT_CACHE_MAX_SIZE:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+class Export:
+    """
+    Base class for admin exports.
+
+    Subclasses declare `columns`; the queryset is planned up front from
+    them, so an export runs a fixed number of queries per chunk of rows.
+    Rows are produced from `queryset.iterator()` and written out as they
+    come: to a write-only workbook (openpyxl spools it to disk instead of
+    keeping every cell in memory), to CSV or to Parquet row groups.
+    Finished files are streamed back in chunks.
+
+    Generated files are cached on disk under a fingerprint of the selected
+    rows and of the state of every model the export reads (see `get_models`).
+    """
+    model = None
+    title = ""
+    columns = []
+    filename = "товары"
+
+    @property
+    def headers(self):
+        return [column.header for column in self.columns]
+
+    def get_lookups(self):
+        return [lookup for column in self.columns for lookup in column.get_lookups()]
+
+    def get_models(self):
+        """Labels of the models (including m2m through models) whose changes affect the export."""
+        labels = {self.model._meta.label_lower}
+        for lookup in self.get_lookups():
+            for field in iter_relations(self.model, lookup):
+                labels.add(field.related_model._meta.label_lower)
+                if field.many_to_many:
+                    # Reverse relations (ManyToManyRel) keep `through` on themselves
+                    through = getattr(field, "through", None) or field.remote_field.through
+                    labels.add(through._meta.label_lower)
+        return labels
+
+    def fingerprint(self, queryset, extension):
+        digest = hashlib.sha256(f"{type(self).__name__}.{extension}".encode())
+        for label in sorted(self.get_models()):
+            digest.update(f"|{label}:{get_export_generation(label)}".encode())
+        digest.update(b"|")
+        for pk in queryset.values_list("pk", flat=True).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            digest.update(f"{pk},".encode())
+        return digest.hexdigest()
+
+    def get_changed_queryset(self, since):
+        """
+        Rows changed since `since`: their own `date_updated` or that of any
+        tracked related row the export reads (e.g. a booking of an item).
+        """
+        paths = {""}
+        for lookup in self.get_lookups():
+            path = []
+            for field in iter_relations(self.model, lookup):
+                path.append(field.name)
+                if has_field(field.related_model, "date_updated"):
+                    paths.add("__".join(path) + "__")
+        # One indexed subquery per path instead of an OR across joined tables
+        condition = Q()
+        for path in sorted(paths):
+            changed = self.model.objects.filter(**{f"{path}date_updated__gte": since}).values("pk")
+            condition |= Q(pk__in=changed)
+        return self.model.objects.filter(condition).order_by("pk")
+
+    def get_queryset(self, queryset):
+        lookups = self.get_lookups()
+        select_related, prefetch_related = plan_related(self.model, lookups)
+        annotations = {
+            column.source: column.annotation
+            for column in self.columns
+            if column.annotation is not None
+        }
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        if annotations:
+            queryset = queryset.annotate(**annotations)
+        return queryset
+
+    def get_row(self, obj):
+        return [column.get_value(obj) for column in self.columns]
+
+    def get_rows(self, queryset, progress=None):
+        count = 0
+        queryset = self.get_queryset(queryset)
+        for count, obj in enumerate(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE), start=1):
+            yield self.get_row(obj)
+            if progress and count % EXPORT_CHUNK_SIZE == 0:
+                progress(count)
+        if progress:
+            progress(count)
+
+    def write_xlsx(self, queryset, file, progress=None):
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet(self.title)
+        sheet.append(self.headers)
+        for row in self.get_rows(queryset, progress):
+            sheet.append(row)
+        workbook.save(file)
+
+    def open_cached(self, queryset, extension, write, progress=None):
+        """
+        Returns the export file for `queryset`, opened for reading.
+        It is served from the cache when nothing it depends on has changed,
+        otherwise `write(queryset, file, progress)` builds it into the cache.
+        """
+        root = Path(settings.EXPORT_CACHE_ROOT)
+        path = root / f"{self.fingerprint(queryset, extension)}.{extension}"
+        try:
+            file = open(path, "rb")
+            os.utime(path)
+            return file
+        except FileNotFoundError:
+            pass
+
+        root.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=root, suffix=".tmp", delete=False) as file:
+            try:
+                write(queryset, file, progress)
+            except BaseException:
+                os.unlink(file.name)
+                raise
+        os.replace(file.name, path)
+        file = open(path, "rb")
+        evict_export_cache()
+        return file
+
+    def write_csv(self, queryset, file, progress=None):
+        text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+        writer = csv.writer(text)
+        writer.writerow(self.headers)
+        writer.writerows(self.get_rows(queryset, progress))
+        text.flush()
+        text.detach()
+
+    def write_parquet(self, queryset, file, progress=None):
+        """Writes one row group per EXPORT_CHUNK_SIZE rows; column types come from the first chunk."""
+        rows = self.get_rows(queryset, progress)
+        schema, writer = None, None
+        while batch := list(islice(rows, EXPORT_CHUNK_SIZE)):
+            columns = list(zip(*batch))
+            if schema is None:
+                schema = pa.schema([
+                    pa.field(header, parquet_type(values))
+                    for header, values in zip(self.headers, columns)
+                ])
+                writer = pq.ParquetWriter(file, schema)
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema,
+            ))
+        if writer is None:
+            schema = pa.schema([pa.field(header, pa.string()) for header in self.headers])
+            writer = pq.ParquetWriter(file, schema)
+        writer.close()
+
+    def get_filename(self, extension):
+        return f"{self.filename}.{extension}"
+
+    def open_file(self, queryset, extension, progress=None):
+        return self.open_cached(queryset, extension, getattr(self, f"write_{extension}"), progress)
+
+    def file_response(self, queryset, extension):
+        file = self.open_file(queryset, extension)
+        # FileResponse is a StreamingHttpResponse: the file is sent in blocks and closed afterwards
+        return FileResponse(
+            file,
+            as_attachment=True,
+            filename=self.get_filename(extension),
+            content_type=EXPORT_FORMATS[extension],
+        )
+
+    def csv_response(self, queryset):
+        """Streams CSV rows to the client while they are read from the database."""
+        writer = csv.writer(Echo())
+        rows = chain([self.headers], self.get_rows(queryset))
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in rows),
+            content_type=EXPORT_FORMATS["csv"],
+        )
+        response["Content-Disposition"] = content_disposition_header(True, self.get_filename("csv"))
+        return response
+
+
+def item_booking_periods(obj):
+    periods = ", ".join(
+        f"{format_date(booking.start_date)}-{format_date(booking.end_date)}"
+        for booking in obj.bookings.all()
+    )
+    return periods or "Нет броннирований"
+
+
+def stock_item(obj):
+    if obj.existing_item:
+        name, storage = obj.existing_item.name, obj.existing_item.storage
+    else:
+        name, storage = obj.new_item_name, obj.new_item_storage
+    return f"{name} ({obj.count}шт.) {storage.name if storage else ''}"
+
+
+def stock_project(obj):
+    project = obj.existing_item.project if obj.existing_item else obj.new_item_project
+    return project.name if project else None
+
+
+class ItemExport(Export):
+    model = models.Item
+    title = "Товары"
+    columns = [
+        Column("Артикул", "article"),
+        Column("Название", "name"),
+        Column("Категория", "category.name"),
+        Column("Количество на складе", "count"),
+        Column("Забронирован?", "is_booked", format=format_bool),
+        Column("Периоды броней", item_booking_periods, related=["bookings"]),
+    ]
+
+
+class ItemStockExport(Export):
+    model = models.ItemStock
+    title = "Заявки на приход"
+    columns = [
+        Column("Товар", stock_item, related=["existing_item__storage", "new_item_storage"]),
+        Column("Проект", stock_project, related=["existing_item__project", "new_item_project"]),
+        Column("Дата прихода", "date", format=format_date),
+    ]
+
+
+class ItemBookingExport(Export):
+    model = models.ItemBooking
+    title = "Заявки на бронь"
+    columns = [
+        Column("Товары", "items", related=["items__storage"], format=format_items),
+        Column("Проект", "project.name"),
+        Column("Город", "city"),
+        Column("Начальная дата", "start_date", format=format_date),
+        Column("Конечная дата", "end_date", format=format_date),
+    ]
+
+
+class ItemRecoveryExport(Export):
+    model = models.ItemRecovery
+    title = "Заявки на утилизацию"
+    columns = [
+        Column("Товар", lambda obj: f"{obj.item.article} | {obj.item.name}", related=["item"]),
+        Column("Количество", "item.count"),
+        Column("Планируемая дата", "planning_date", format=format_date),
+        Column("Подтверждение утилизации кладовщиком", "is_approved", format=format_bool),
+    ]
+
+
+class ItemRefundExport(Export):
+    model = models.ItemRefund
+    title = "Заявки на возврат"
+    columns = [
+        Column("Товары", "items", related=["items__storage"], format=format_items),
+        Column("Проект", "project.name"),
+        Column("Город (откуда едет)", "city"),
+        Column("Дата прихода", "date", format=format_date),
+    ]
+
+
+class ItemConsumptionExport(Export):
+    model = models.ItemConsumption
+    title = "Заявки на расход"
+    columns = [
+        Column("Товары", "booking.items", related=["booking__items__storage"], format=format_items),
+        Column("Проект", "booking.project.name"),
+        Column("Город (куда едет)", "city"),
+        Column("Дата отправки", "date", format=format_date),
+    ]
+
+
+EXPORTS = {
+    export.model._meta.label_lower: export
+    for export in [
+        ItemExport,
+        ItemStockExport,
+        ItemBookingExport,
+        ItemRecoveryExport,
+        ItemRefundExport,
+        ItemConsumptionExport,
+    ]
+}
+
+
+def export_delta(export_class, consumer, extension, file):
+    """
+    Writes the rows changed since `consumer`'s previous delta export of the
+    same data and moves its checkpoint. The first export contains every row.
+    Deleted rows are not reported.
+    """
+    export = export_class()
+    label = export.model._meta.label_lower
+    started = now()
+    checkpoint = models.ExportCheckpoint.objects.filter(consumer=consumer, model=label).first()
+
+    if checkpoint:
+        queryset = export.get_changed_queryset(checkpoint.date_exported - EXPORT_DELTA_OVERLAP)
+    else:
+        queryset = export.model.objects.order_by("pk")
+
+    count = 0
+
+    def progress(value):
+        nonlocal count
+        count = value
+
+    getattr(export, f"write_{extension}")(queryset, file, progress)
+    models.ExportCheckpoint.objects.update_or_create(
+        consumer=consumer,
+        model=label,
+        defaults={"date_exported": started},
+    )
+    return count
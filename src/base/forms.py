@@ -1,8 +1,13 @@
+from collections import defaultdict
+
 from django import forms
+from django.forms.models import BaseInlineFormSet
 from django.utils.safestring import mark_safe
 from django.contrib.auth.hashers import make_password
 
-from base.models import User, ItemStock, ItemBooking, ItemBookingItemM2M
+from base.models import User, ItemStock, ImportJob, ItemBooking, ItemBookingItemM2M
+from base.imports import IMPORTS
+from base.availability import reserve_items
 
 
 class CustomUserCreationForm(forms.ModelForm):
@@ -38,8 +43,47 @@ class BookingAdminForm(forms.ModelForm):
         model = ItemBooking
         fields = "__all__"
 
-    class Media:
-        js = (
-            "//ajax.googleapis.com/ajax/libs/jquery/3.4.1/jquery.min.js",
-            "admin/js/item_booking.js",
-        )
\ No newline at end of file
+
+class ImportJobForm(forms.ModelForm):
+    model = forms.ChoiceField(
+        label="Данные*",
+        choices=[(label, import_class.title) for label, import_class in IMPORTS.items()],
+    )
+    # Labels of the IMPORTS offered, all when None (set per user by AdminImportJob)
+    import_models = None
+    
+    class Meta:
+        model = ImportJob
+        fields = ["model", "file", "approve"]
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.import_models is not None and "model" in self.fields:
+            self.fields["model"].choices = [
+                (label, title) for label, title in self.fields["model"].choices
+                if label in self.import_models
+            ]
+    
+    def clean_file(self):
+        file = self.cleaned_data["file"]
+        if file.name.rsplit(".", 1)[-1].lower() not in ("xlsx", "csv"):
+            raise forms.ValidationError("Поддерживаются только файлы .xlsx и .csv")
+        return file
+
+
+class ItemBookingItemFormSet(BaseInlineFormSet):
+    def clean(self):
+        """
+        Re-checks the whole booking against the other bookings under item
+        locks held until the admin transaction commits.
+        """
+        super().clean()
+        booking = self.instance
+        if any(self.errors) or not booking.start_date or not booking.end_date:
+            return
+        quantities = defaultdict(int)
+        for form in self.forms:
+            if not form.cleaned_data or form.cleaned_data.get("DELETE") or not form.cleaned_data.get("item"):
+                continue
+            quantities[form.cleaned_data["item"].pk] += form.cleaned_data.get("item_count") or 0
+        reserve_items(quantities, booking.start_date, booking.end_date, exclude_booking=booking.pk)
@@ -0,0 +1,356 @@
+import io
+import csv
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+import openpyxl
+
+from django.db import models as db_models, transaction
+from django.core.exceptions import ValidationError
+
+from base import models
+from base.articles import allocate_articles
+from base.exports import bump_export_generation
+from base.stock import record_movements
+from base.services import approve_stocks
+
+
+IMPORT_CHUNK_SIZE = 1000
+# Row errors kept on the job, the rest are only counted
+IMPORT_MAX_ERRORS = 500
+
+
+def normalize(value):
+    return " ".join(str(value).replace("*", "").split()).casefold()
+
+
+def iter_rows(file, filename):
+    """Streams the rows (tuples of cell values) of an .xlsx or .csv file."""
+    extension = filename.rsplit(".", 1)[-1].lower()
+    if extension == "xlsx":
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            yield from workbook.active.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    elif extension == "csv":
+        text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+        sample = text.read(4096)
+        text.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(text, dialect)
+    else:
+        raise ValueError("Поддерживаются только файлы .xlsx и .csv")
+
+
+def parse_decimal(value):
+    try:
+        return Decimal(str(value).replace(",", ".").replace(" ", ""))
+    except InvalidOperation:
+        raise ValidationError(f"«{value}» не является числом")
+
+
+def parse_count(value):
+    number = parse_decimal(value)
+    if number != number.to_integral_value() or number < 0:
+        raise ValidationError(f"«{value}» не является целым неотрицательным числом")
+    return int(number)
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    for format in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(str(value).strip(), format).date()
+        except ValueError:
+            pass
+    raise ValidationError(f"«{value}» не является датой (ДД.ММ.ГГГГ)")
+
+
+class Import:
+    """
+    Streams rows of an uploaded file into `model` objects. Columns are
+    matched to `fields` by verbose name (or field name), foreign keys in
+    `lookups` ({field: name attribute of the related model}) are resolved
+    by name through maps loaded once per run.
+    """
+    model = None
+    title = None
+    fields = []
+    lookups = {}
+    # {header: field name} for columns not named after the field
+    aliases = {}
+
+    def __init__(self, **options):
+        self.options = options
+
+    def get_fields(self):
+        return [self.model._meta.get_field(name) for name in self.fields]
+
+    def get_columns(self, headers):
+        """{column index: field} for the recognised headers."""
+        names = {}
+        for field in self.get_fields():
+            names[normalize(field.verbose_name)] = field
+            names[normalize(field.name)] = field
+        for header, name in self.aliases.items():
+            names[normalize(header)] = self.model._meta.get_field(name)
+        columns = {
+            index: names[normalize(header)]
+            for index, header in enumerate(headers)
+            if header is not None and normalize(header) in names
+        }
+        missing = [
+            str(field.verbose_name) for field in self.get_fields()
+            if self.is_required(field) and field not in columns.values()
+        ]
+        if missing:
+            raise ValueError(f"В файле нет обязательных столбцов: {', '.join(missing)}")
+        return columns
+
+    def is_required(self, field):
+        return not field.blank and not field.has_default()
+
+    def get_lookup_maps(self):
+        maps = {}
+        for name, attribute in self.lookups.items():
+            related = self.model._meta.get_field(name).related_model
+            maps[name] = {
+                normalize(value): pk
+                for pk, value in related.objects.values_list("pk", attribute)
+            }
+        return maps
+
+    def parse_value(self, field, value, maps):
+        if field.name in maps:
+            pk = maps[field.name].get(normalize(value))
+            if pk is None:
+                raise ValidationError(f"«{value}» не найден")
+            return pk
+        if isinstance(field, db_models.DecimalField):
+            return parse_decimal(value)
+        if isinstance(field, db_models.PositiveIntegerField):
+            return parse_count(value)
+        if isinstance(field, db_models.DateField):
+            return parse_date(value)
+        return str(value).strip()
+
+    def parse_row(self, row, columns, maps):
+        """Returns {field attname: value}, raises ValidationError with the row problems."""
+        values, errors, invalid = {}, [], set()
+        for index, field in columns.items():
+            value = row[index] if index < len(row) else None
+            if value is None or str(value).strip() == "":
+                continue
+            try:
+                values[field.attname] = self.parse_value(field, value, maps)
+            except ValidationError as e:
+                invalid.add(field)
+                errors += [f"{field.verbose_name}: {message}" for message in e.messages]
+        for field in self.get_fields():
+            if self.is_required(field) and field.attname not in values and field not in invalid:
+                errors.append(f"{field.verbose_name}: обязательное поле")
+        if errors:
+            raise ValidationError(errors)
+        return values
+
+    def resolve_rows(self, parsed):
+        """
+        Hook for checks needing the whole chunk (one query for all rows):
+        takes [(row number, values)], returns (rows to save, errors).
+        """
+        return [values for number, values in parsed], []
+
+    def save_objects(self, rows):
+        """Saves the parsed rows of one chunk, returns the number of created objects."""
+        objects = self.model.objects.bulk_create([self.model(**values) for values in rows])
+        return len(objects)
+
+    def run(self, file, filename, progress=None):
+        """
+        Imports the file chunk by chunk, each chunk in its own transaction.
+        Returns (created, errors); rows with errors are skipped.
+        """
+        rows = iter(iter_rows(file, filename))
+        columns = self.get_columns(next(rows, ()))
+        maps = self.get_lookup_maps()
+        created, errors, processed = 0, [], 0
+        numbered = enumerate(rows, start=2)
+        while chunk := list(islice(numbered, IMPORT_CHUNK_SIZE)):
+            parsed = []
+            for number, row in chunk:
+                if not any(value not in (None, "") for value in row):
+                    continue
+                try:
+                    parsed.append((number, self.parse_row(row, columns, maps)))
+                except ValidationError as e:
+                    errors.append(f"Строка {number}: {'; '.join(e.messages)}")
+            parsed, chunk_errors = self.resolve_rows(parsed)
+            errors += chunk_errors
+            with transaction.atomic():
+                created += self.save_objects(parsed)
+            processed += len(chunk)
+            if progress:
+                progress(processed)
+        if created:
+            bump_export_generation(self.model)
+        return created, errors
+
+
+class ItemImport(Import):
+    model = models.Item
+    title = "Товары"
+    fields = [
+        "name", "description", "weight", "height", "width", "length", "count",
+        "project", "client", "storage", "category", "status", "expiration_date",
+    ]
+    lookups = {
+        "project": "name",
+        "client": "name",
+        "storage": "name",
+        "category": "name",
+        "status": "text",
+    }
+
+    def is_required(self, field):
+        # Склад обязателен в форме товара
+        return field.name == "storage" or super().is_required(field)
+
+    def save_objects(self, rows):
+        items = [
+            models.Item(article=article, **values)
+            for values, article in zip(rows, allocate_articles(len(rows)))
+        ]
+        models.Item.fill_clients(items)
+        models.Item.objects.bulk_create(items)
+        record_movements([
+            models.StockMovement(item=item, kind="opening", quantity=item.count)
+            for item in items
+        ], apply=False)
+        return len(items)
+
+
+class ItemStockImport(Import):
+    """
+    Supplier manifest: a line refers to an existing item by article or by
+    name, otherwise it requests a new item. Lines naming the same new item
+    make one request for their total quantity, with the details of the
+    first line. With the `approve` option the created requests are
+    approved at the end, in one transaction.
+    """
+    model = models.ItemStock
+    title = "Заявки на приход (накладная)"
+    fields = [
+        "count", "planning_date", "date",
+        "new_item_description", "new_item_weight", "new_item_height",
+        "new_item_width", "new_item_length", "new_item_project", "new_item_client",
+        "new_item_storage", "new_item_category", "new_item_status", "new_item_expiration_date",
+    ]
+    lookups = {
+        "new_item_project": "name",
+        "new_item_client": "name",
+        "new_item_storage": "name",
+        "new_item_category": "name",
+        "new_item_status": "text",
+    }
+    aliases = {
+        "Количество": "count",
+        "Описание": "new_item_description",
+        "Масса (кг)": "new_item_weight",
+        "Высота (см)": "new_item_height",
+        "Ширина (см)": "new_item_width",
+        "Длина (см)": "new_item_length",
+        "Проект": "new_item_project",
+        "Клиент": "new_item_client",
+        "Склад": "new_item_storage",
+        "Категория": "new_item_category",
+        "Состояние": "new_item_status",
+        "Срок годности": "new_item_expiration_date",
+    }
+
+    def get_columns(self, headers):
+        columns = super().get_columns(headers)
+        normalized = [normalize(header) if header is not None else None for header in headers]
+        self.article_column = normalized.index("артикул") if "артикул" in normalized else None
+        self.name_column = normalized.index("название") if "название" in normalized else None
+        if self.article_column is None and self.name_column is None:
+            raise ValueError("В файле нет столбца «Артикул» или «Название»")
+        return columns
+
+    def parse_row(self, row, columns, maps):
+        values = super().parse_row(row, columns, maps)
+        for key, index in [("article", self.article_column), ("name", self.name_column)]:
+            value = row[index] if index is not None and index < len(row) else None
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            values[key] = str(value).strip() if value not in (None, "") else None
+        # Spreadsheets drop the leading zeros of numeric articles
+        if values["article"] and values["article"].isdigit():
+            values["article"] = values["article"].zfill(models.Item._meta.get_field("article").max_length)
+        if not values["article"] and not values["name"]:
+            raise ValidationError("Укажите артикул или название товара")
+        return values
+
+    def resolve_rows(self, parsed):
+        articles = {values["article"] for number, values in parsed if values["article"]}
+        names = {values["name"] for number, values in parsed if values["name"] and not values["article"]}
+        existing = set(models.Item.objects.filter(article__in=articles).values_list("article", flat=True))
+        by_name = {}
+        for article, name in models.Item.objects.filter(name__in=names).values_list("article", "name"):
+            by_name.setdefault(name, []).append(article)
+
+        rows, errors = [], []
+        for number, values in parsed:
+            article, name = values.pop("article"), values.pop("name")
+            if article:
+                if article not in existing:
+                    errors.append(f"Строка {number}: товар с артикулом {article} не найден")
+                    continue
+                values.update(request_type="existing", existing_item_id=article)
+            elif len(by_name.get(name, [])) > 1:
+                errors.append(f"Строка {number}: несколько товаров с названием «{name}», укажите артикул")
+                continue
+            elif name in by_name:
+                values.update(request_type="existing", existing_item_id=by_name[name][0])
+            elif name in self.new_rows:
+                self.new_rows[name]["count"] += values["count"]
+                continue
+            elif not values.get("new_item_storage_id"):
+                errors.append(f"Строка {number}: товар «{name}» не найден, для нового товара укажите склад")
+                continue
+            else:
+                # Saved once the whole file is read (see run)
+                values.update(request_type="new", new_item_name=name)
+                self.new_rows[name] = values
+                continue
+            rows.append(values)
+        return rows, errors
+
+    def save_objects(self, rows):
+        stocks = models.ItemStock.objects.bulk_create([models.ItemStock(**values) for values in rows])
+        self.created_ids += [stock.pk for stock in stocks]
+        return len(stocks)
+
+    def run(self, file, filename, progress=None):
+        self.created_ids, self.new_rows = [], {}
+        created, errors = super().run(file, filename, progress)
+        if self.new_rows:
+            with transaction.atomic():
+                created += self.save_objects(list(self.new_rows.values()))
+            bump_export_generation(self.model)
+        if self.options.get("approve") and self.created_ids:
+            approve_stocks(models.ItemStock.objects.filter(pk__in=self.created_ids))
+        return created, errors
+
+
+IMPORTS = {
+    import_class.model._meta.label_lower: import_class
+    for import_class in [ItemImport, ItemStockImport]
+}
@@ -0,0 +1,70 @@
+from django.db import connection
+
+from base.batches import CommitBatch
+
+
+# Same text as the former ItemBooking.__str__, without the archive mark
+BOOKING_LABELS_SQL = """
+    UPDATE base_itembooking AS booking
+    SET label = labels.label
+    FROM (
+        SELECT booking.id,
+            concat_ws(' ', client.name, project.name,
+                to_char(booking.start_date, 'YYYY-MM-DD') || '-' || to_char(booking.end_date, 'YYYY-MM-DD')
+            ) AS label
+        FROM base_itembooking AS booking
+        JOIN base_project AS project ON project.id = booking.project_id
+        LEFT JOIN base_client AS client ON client.id = project.client_id
+        WHERE booking.id = ANY(%(bookings)s)
+    ) AS labels
+    WHERE booking.id = labels.id AND booking.label IS DISTINCT FROM labels.label
+"""
+
+# Same text as the former ItemConsumption.__str__: the storage of the first item of the booking
+CONSUMPTION_LABELS_SQL = """
+    UPDATE base_itemconsumption AS consumption
+    SET label = labels.label
+    FROM (
+        SELECT consumption.id,
+            concat_ws(' ', client.name, project.name,
+                to_char(consumption.date_created AT TIME ZONE 'UTC', 'YYYY-MM-DD'),
+                storage.name || ' (' || storage.free_area || ' кв.м. свободно)'
+            ) AS label
+        FROM base_itemconsumption AS consumption
+        JOIN base_itembooking AS booking ON booking.id = consumption.booking_id
+        JOIN base_project AS project ON project.id = booking.project_id
+        LEFT JOIN base_client AS client ON client.id = project.client_id
+        LEFT JOIN LATERAL (
+            SELECT item.storage_id FROM base_itembookingitemm2m AS line
+            JOIN base_item AS item ON item.article = line.item_id
+            WHERE line.booking_id = booking.id
+            ORDER BY item.article
+            LIMIT 1
+        ) AS first_item ON true
+        LEFT JOIN base_storage AS storage ON storage.id = first_item.storage_id
+        WHERE consumption.booking_id = ANY(%(bookings)s)
+    ) AS labels
+    WHERE consumption.id = labels.id AND consumption.label IS DISTINCT FROM labels.label
+"""
+
+
+def refresh_labels(bookings):
+    """
+    Recomputes the stored labels of `bookings` (ids or a values_list("pk")
+    queryset) and of their consumptions, two UPDATEs; unchanged rows are
+    not written.
+    """
+    params = {"bookings": list(bookings)}
+    if not params["bookings"]:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(BOOKING_LABELS_SQL, params)
+        cursor.execute(CONSUMPTION_LABELS_SQL, params)
+
+
+pending = CommitBatch("label_refresh", refresh_labels)
+
+
+def schedule_label_refresh(bookings):
+    """refresh_labels for `bookings`, once per transaction, when it commits."""
+    pending.add(*bookings)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from base.exports import EXPORTS, EXPORT_FORMATS, export_delta
+
+
+class Command(BaseCommand):
+    help = "Выгрузка строк, изменившихся с прошлой выгрузки для потребителя"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", choices=sorted(EXPORTS), help="Данные, например base.item")
+        parser.add_argument("output", help="Путь к файлу выгрузки")
+        parser.add_argument("--consumer", required=True, help="Имя потребителя (своя отметка выгрузки)")
+        parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["output"], "wb") as file:
+                count = export_delta(
+                    EXPORTS[options["model"]],
+                    options["consumer"],
+                    options["format"],
+                    file,
+                )
+        except OSError as e:
+            raise CommandError(e)
+        self.stdout.write(f"Выгружено строк: {count}")
@@ -0,0 +1,37 @@
+# Generated by Django 5.1 on 2026-10-16 20:34
+
+import base.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0022_alter_itembooking_is_archived_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=64, verbose_name='Данные')),
+                ('pks', models.JSONField(default=list, editable=False)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=16, verbose_name='Статус')),
+                ('progress', models.PositiveIntegerField(default=0, verbose_name='Выгружено строк')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Всего строк')),
+                ('file', models.FileField(blank=True, null=True, upload_to=base.models.get_export_file_path, verbose_name='Файл')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Ошибка')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('date_finished', models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='export_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Выгрузка',
+                'verbose_name_plural': 'Выгрузки',
+                'ordering': ['-date_created'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-16 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0023_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='format',
+            field=models.CharField(choices=[('xlsx', 'XLSX'), ('csv', 'CSV'), ('parquet', 'Parquet')], default='xlsx', max_length=16, verbose_name='Формат'),
+        ),
+    ]
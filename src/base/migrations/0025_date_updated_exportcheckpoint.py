@@ -0,0 +1,57 @@
+# Generated by Django 5.1 on 2026-10-16 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0024_exportjob_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AddField(
+            model_name='itembooking',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AddField(
+            model_name='itemconsumption',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AddField(
+            model_name='itemrecovery',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AddField(
+            model_name='itemrefund',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AddField(
+            model_name='itemstock',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+        migrations.CreateModel(
+            name='ExportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consumer', models.CharField(max_length=128, verbose_name='Потребитель')),
+                ('model', models.CharField(max_length=64, verbose_name='Данные')),
+                ('date_exported', models.DateTimeField(verbose_name='Изменения выгружены по')),
+            ],
+            options={
+                'verbose_name': 'Отметка выгрузки изменений',
+                'verbose_name_plural': 'Отметки выгрузки изменений',
+                'constraints': [models.UniqueConstraint(fields=('consumer', 'model'), name='unique_export_checkpoint')],
+            },
+        ),
+    ]
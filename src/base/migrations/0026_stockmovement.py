@@ -0,0 +1,45 @@
+# Generated by Django 5.1 on 2026-10-16 20:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0025_date_updated_exportcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('opening', 'Начальный остаток'), ('arrival', 'Приход'), ('consumption', 'Расход'), ('refund', 'Возврат'), ('recovery', 'Утилизация'), ('adjustment', 'Корректировка')], max_length=16, verbose_name='Тип')),
+                ('quantity', models.IntegerField(verbose_name='Количество (+ приход, - списание)')),
+                ('date', models.DateField(default=django.utils.timezone.localdate, verbose_name='Дата')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('consumption', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='base.itemconsumption', verbose_name='Заявка на расход')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='base.item', verbose_name='Товар')),
+                ('recovery', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='base.itemrecovery', verbose_name='Заявка на утилизацию')),
+                ('refund', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='base.itemrefund', verbose_name='Заявка на возврат')),
+                ('stock', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='base.itemstock', verbose_name='Заявка на приход')),
+            ],
+            options={
+                'verbose_name': 'Движение товара',
+                'verbose_name_plural': 'Движения товаров',
+                'indexes': [models.Index(fields=['item', 'date'], name='stockmovement_item_date')],
+            },
+        ),
+        migrations.RunSQL(
+            # Opening balances, so that the movements of every item sum up to Item.count
+            sql="""
+                INSERT INTO base_stockmovement (item_id, kind, quantity, date, date_created)
+                SELECT article, 'opening', count, CURRENT_DATE, NOW()
+                FROM base_item
+                WHERE count > 0
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1 on 2026-10-16 20:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0026_stockmovement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='Дата')),
+                ('balance', models.IntegerField(verbose_name='Остаток')),
+            ],
+            options={
+                'verbose_name': 'Остаток на дату',
+                'verbose_name_plural': 'Остатки на дату',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['date'], name='stockmovement_date'),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshot',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='base.item', verbose_name='Товар'),
+        ),
+        migrations.AddConstraint(
+            model_name='stocksnapshot',
+            constraint=models.UniqueConstraint(fields=('item', 'date'), name='unique_stock_snapshot'),
+        ),
+    ]
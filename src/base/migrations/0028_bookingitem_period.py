@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-16 20:45
+
+import django.contrib.postgres.fields.ranges
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0027_stocksnapshot'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.AddField(
+            model_name='itembookingitemm2m',
+            name='period',
+            field=django.contrib.postgres.fields.ranges.DateRangeField(blank=True, editable=False, null=True, verbose_name='Период брони'),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE base_itembookingitemm2m AS line
+                SET period = daterange(booking.start_date, booking.end_date, '[]')
+                FROM base_itembooking AS booking
+                WHERE booking.id = line.booking_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='itembookingitemm2m',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['item', 'period'], name='bookingitem_item_period'),
+        ),
+    ]
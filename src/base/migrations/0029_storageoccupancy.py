@@ -0,0 +1,29 @@
+# Generated by Django 5.1 on 2026-10-16 20:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0028_bookingitem_period'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('booked_count', models.PositiveIntegerField(default=0, verbose_name='Забронировано (шт.)')),
+                ('booked_area', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Забронированная площадь (кв.м.)')),
+                ('storage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='base.storage', verbose_name='Склад')),
+            ],
+            options={
+                'verbose_name': 'Занятость склада',
+                'verbose_name_plural': 'Занятость складов',
+                'constraints': [models.UniqueConstraint(fields=('storage', 'date'), name='unique_storage_occupancy')],
+            },
+        ),
+    ]
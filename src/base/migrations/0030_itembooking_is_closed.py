@@ -0,0 +1,27 @@
+# Generated by Django 5.1 on 2026-10-16 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0029_storageoccupancy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itembooking',
+            name='is_closed',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Завершена'),
+        ),
+        # Bookings ended before today; is_archived (processed by the storekeeper) is kept as is
+        migrations.RunSQL(
+            sql="UPDATE base_itembooking SET is_closed = true WHERE end_date < CURRENT_DATE",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='itembooking',
+            index=models.Index(condition=models.Q(('is_closed', False)), fields=['end_date'], name='booking_open_end_date'),
+        ),
+    ]
@@ -0,0 +1,143 @@
+# Generated by Django 5.1 on 2026-10-16 20:52
+
+from django.db import migrations, models
+
+
+BACKFILL_SQL = """
+    UPDATE base_item AS item SET
+        booked_count = COALESCE(active.quantity, 0),
+        active_booking_count = COALESCE(active.bookings, 0),
+        is_booked = COALESCE(active.bookings, 0) > 0
+    FROM base_item AS target
+    LEFT JOIN (
+        SELECT line.item_id, SUM(line.item_count) AS quantity, COUNT(*) AS bookings
+        FROM base_itembookingitemm2m AS line
+        JOIN base_itembooking AS booking ON booking.id = line.booking_id
+        WHERE booking.is_approved AND NOT booking.is_closed
+        GROUP BY line.item_id
+    ) AS active ON active.item_id = target.article
+    WHERE item.article = target.article
+"""
+
+TRIGGERS_SQL = """
+    -- Counters are written by the triggers below only (nested, trigger depth > 1).
+    -- These also move date_updated, which delta exports select changed items by
+    CREATE FUNCTION base_item_protect_booking_counters() RETURNS trigger AS $$
+    BEGIN
+        IF pg_trigger_depth() = 1 THEN
+            IF TG_OP = 'INSERT' THEN
+                NEW.booked_count := 0;
+                NEW.active_booking_count := 0;
+                NEW.is_booked := false;
+            ELSE
+                NEW.booked_count := OLD.booked_count;
+                NEW.active_booking_count := OLD.active_booking_count;
+                NEW.is_booked := OLD.is_booked;
+            END IF;
+        END IF;
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER base_item_protect_booking_counters
+    BEFORE INSERT OR UPDATE ON base_item
+    FOR EACH ROW EXECUTE FUNCTION base_item_protect_booking_counters();
+
+    CREATE FUNCTION base_item_add_booking(p_item varchar, p_quantity bigint, p_bookings bigint) RETURNS void AS $$
+        UPDATE base_item SET
+            booked_count = booked_count + p_quantity,
+            active_booking_count = active_booking_count + p_bookings,
+            is_booked = active_booking_count + p_bookings > 0,
+            date_updated = now()
+        WHERE article = p_item;
+    $$ LANGUAGE sql;
+
+    CREATE FUNCTION base_booking_is_active(p_booking bigint) RETURNS boolean AS $$
+        SELECT EXISTS (
+            SELECT 1 FROM base_itembooking WHERE id = p_booking AND is_approved AND NOT is_closed
+        );
+    $$ LANGUAGE sql STABLE;
+
+    -- Lines of active (approved, not closed) bookings
+    CREATE FUNCTION base_bookingitem_counters() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND base_booking_is_active(OLD.booking_id) THEN
+            PERFORM base_item_add_booking(OLD.item_id, -OLD.item_count, -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND base_booking_is_active(NEW.booking_id) THEN
+            PERFORM base_item_add_booking(NEW.item_id, NEW.item_count, 1);
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER base_bookingitem_counters_insert_delete
+    AFTER INSERT OR DELETE ON base_itembookingitemm2m
+    FOR EACH ROW EXECUTE FUNCTION base_bookingitem_counters();
+
+    CREATE TRIGGER base_bookingitem_counters_update
+    AFTER UPDATE OF item_id, booking_id, item_count ON base_itembookingitemm2m
+    FOR EACH ROW EXECUTE FUNCTION base_bookingitem_counters();
+
+    -- Bookings becoming active or inactive, one UPDATE per statement (batched closing)
+    CREATE FUNCTION base_booking_counters() RETURNS trigger AS $$
+    BEGIN
+        UPDATE base_item AS item SET
+            booked_count = item.booked_count + changes.quantity,
+            active_booking_count = item.active_booking_count + changes.bookings,
+            is_booked = item.active_booking_count + changes.bookings > 0,
+            date_updated = now()
+        FROM (
+            SELECT line.item_id, SUM(changed.sign * line.item_count) AS quantity, SUM(changed.sign) AS bookings
+            FROM (
+                SELECT new_rows.id,
+                    CASE WHEN new_rows.is_approved AND NOT new_rows.is_closed THEN 1 ELSE -1 END AS sign
+                FROM new_rows
+                JOIN old_rows ON old_rows.id = new_rows.id
+                WHERE (old_rows.is_approved AND NOT old_rows.is_closed)
+                    <> (new_rows.is_approved AND NOT new_rows.is_closed)
+            ) AS changed
+            JOIN base_itembookingitemm2m AS line ON line.booking_id = changed.id
+            GROUP BY line.item_id
+        ) AS changes
+        WHERE item.article = changes.item_id;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER base_booking_counters
+    AFTER UPDATE ON base_itembooking
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION base_booking_counters();
+"""
+
+DROP_TRIGGERS_SQL = """
+    DROP TRIGGER base_booking_counters ON base_itembooking;
+    DROP TRIGGER base_bookingitem_counters_update ON base_itembookingitemm2m;
+    DROP TRIGGER base_bookingitem_counters_insert_delete ON base_itembookingitemm2m;
+    DROP TRIGGER base_item_protect_booking_counters ON base_item;
+    DROP FUNCTION base_booking_counters();
+    DROP FUNCTION base_bookingitem_counters();
+    DROP FUNCTION base_booking_is_active(bigint);
+    DROP FUNCTION base_item_add_booking(varchar, bigint, bigint);
+    DROP FUNCTION base_item_protect_booking_counters();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0030_itembooking_is_closed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='active_booking_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Активных броней'),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='booked_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Забронировано (шт.)'),
+        ),
+        migrations.RunSQL(sql=BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(sql=TRIGGERS_SQL, reverse_sql=DROP_TRIGGERS_SQL),
+    ]
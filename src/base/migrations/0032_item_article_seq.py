@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-16 20:54
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0031_item_booking_counters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="CREATE SEQUENCE base_item_article_seq MINVALUE 0 MAXVALUE 999999 START 0 NO CYCLE",
+            reverse_sql="DROP SEQUENCE base_item_article_seq",
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1 on 2026-10-16 20:55
+
+import base.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0032_item_article_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=64, verbose_name='Данные*')),
+                ('file', models.FileField(upload_to=base.models.get_import_file_path, verbose_name='Файл (.xlsx, .csv)*')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=16, verbose_name='Статус')),
+                ('progress', models.PositiveIntegerField(default=0, verbose_name='Обработано строк')),
+                ('created', models.PositiveIntegerField(default=0, verbose_name='Загружено записей')),
+                ('errors', models.TextField(blank=True, null=True, verbose_name='Ошибки')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('date_finished', models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Загрузка',
+                'verbose_name_plural': 'Загрузки',
+                'ordering': ['-date_created'],
+            },
+        ),
+    ]
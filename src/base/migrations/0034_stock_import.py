@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-16 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0033_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='approve',
+            field=models.BooleanField(default=False, help_text='Для заявок на приход: подтвердить все загруженные заявки одной транзакцией', verbose_name='Сразу подтвердить'),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='name',
+            field=models.CharField(db_index=True, max_length=128, verbose_name='Название*'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1 on 2026-10-16 21:00
+
+from django.db import migrations, models
+
+
+# Labels of the existing rows (the same text as base.labels computes)
+BACKFILL_BOOKING_LABELS_SQL = """
+    UPDATE base_itembooking AS booking
+    SET label = labels.label
+    FROM (
+        SELECT booking.id,
+            concat_ws(' ', client.name, project.name,
+                to_char(booking.start_date, 'YYYY-MM-DD') || '-' || to_char(booking.end_date, 'YYYY-MM-DD')
+            ) AS label
+        FROM base_itembooking AS booking
+        JOIN base_project AS project ON project.id = booking.project_id
+        LEFT JOIN base_client AS client ON client.id = project.client_id
+    ) AS labels
+    WHERE booking.id = labels.id AND booking.label IS DISTINCT FROM labels.label
+"""
+
+BACKFILL_CONSUMPTION_LABELS_SQL = """
+    UPDATE base_itemconsumption AS consumption
+    SET label = labels.label
+    FROM (
+        SELECT consumption.id,
+            concat_ws(' ', client.name, project.name,
+                to_char(consumption.date_created AT TIME ZONE 'UTC', 'YYYY-MM-DD'),
+                storage.name || ' (' || storage.free_area || ' кв.м. свободно)'
+            ) AS label
+        FROM base_itemconsumption AS consumption
+        JOIN base_itembooking AS booking ON booking.id = consumption.booking_id
+        JOIN base_project AS project ON project.id = booking.project_id
+        LEFT JOIN base_client AS client ON client.id = project.client_id
+        LEFT JOIN LATERAL (
+            SELECT item.storage_id FROM base_itembookingitemm2m AS line
+            JOIN base_item AS item ON item.article = line.item_id
+            WHERE line.booking_id = booking.id
+            ORDER BY item.article
+            LIMIT 1
+        ) AS first_item ON true
+        LEFT JOIN base_storage AS storage ON storage.id = first_item.storage_id
+    ) AS labels
+    WHERE consumption.id = labels.id AND consumption.label IS DISTINCT FROM labels.label
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0034_stock_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itembooking',
+            name='label',
+            field=models.CharField(blank=True, default='', editable=False, max_length=1024, verbose_name='Название'),
+        ),
+        migrations.AddField(
+            model_name='itemconsumption',
+            name='label',
+            field=models.CharField(blank=True, default='', editable=False, max_length=1024, verbose_name='Название'),
+        ),
+        migrations.RunSQL(BACKFILL_BOOKING_LABELS_SQL, migrations.RunSQL.noop),
+        migrations.RunSQL(BACKFILL_CONSUMPTION_LABELS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1 on 2026-10-16 21:02
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.functions.text
+from django.db import migrations
+
+
+SEARCH_VECTOR_SQL = """
+    CREATE FUNCTION base_item_search_vector_of(article text, name text, description text)
+    RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('simple', coalesce(article, '')), 'A')
+            || setweight(to_tsvector('russian', coalesce(name, '')), 'A')
+            || setweight(to_tsvector('russian', coalesce(description, '')), 'C')
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE FUNCTION base_item_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := base_item_search_vector_of(NEW.article, NEW.name, NEW.description);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER base_item_search_vector
+        BEFORE INSERT OR UPDATE OF article, name, description, search_vector ON base_item
+        FOR EACH ROW EXECUTE FUNCTION base_item_search_vector();
+
+    UPDATE base_item SET search_vector = base_item_search_vector_of(article, name, description);
+"""
+
+DROP_SEARCH_VECTOR_SQL = """
+    DROP TRIGGER base_item_search_vector ON base_item;
+    DROP FUNCTION base_item_search_vector();
+    DROP FUNCTION base_item_search_vector_of(text, text, text);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0036_item_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_SQL, DROP_SEARCH_VECTOR_SQL),
+        migrations.AddIndex(
+            model_name='item',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('description'), name='gin_trgm_ops'), name='item_description_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='item_search_vector'),
+        ),
+    ]
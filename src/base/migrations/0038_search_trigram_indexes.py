@@ -0,0 +1,19 @@
+# Generated by Django 5.1 on 2026-10-16 21:22
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0037_item_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='project_name_trgm'),
+        ),
+    ]
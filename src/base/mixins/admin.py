@@ -0,0 +1,128 @@
+from django.contrib import messages
+from django.db import transaction
+from django.urls import reverse
+from django.utils.html import format_html
+
+from base.models import Item, ExportJob
+from base.search import search_items
+from base.roles import is_storekeeper
+
+
+class ExportMixin:
+    """
+    Adds export actions driven by `export_class` (see base.exports).
+    Background variants hand the selection over to a Celery task.
+    """
+    export_class = None
+    actions = [
+        "export_as_xlsx",
+        "export_as_csv",
+        "export_as_parquet",
+        "export_as_xlsx_background",
+        "export_as_parquet_background",
+    ]
+
+    def export_as_xlsx(self, request, queryset):
+        return self.export_class().file_response(queryset, "xlsx")
+
+    export_as_xlsx.short_description = "Выгрузить .XLSX"
+
+    def export_as_csv(self, request, queryset):
+        return self.export_class().csv_response(queryset)
+
+    export_as_csv.short_description = "Выгрузить .CSV"
+
+    def export_as_parquet(self, request, queryset):
+        return self.export_class().file_response(queryset, "parquet")
+
+    export_as_parquet.short_description = "Выгрузить .Parquet"
+
+    def export_in_background(self, request, queryset, format):
+        from base.tasks import run_export_job
+
+        job = ExportJob.objects.create(
+            user=request.user,
+            model=self.model._meta.label_lower,
+            format=format,
+            pks=list(queryset.values_list("pk", flat=True)),
+        )
+        transaction.on_commit(lambda: run_export_job.delay(job.pk))
+        self.message_user(
+            request,
+            format_html(
+                'Выгрузка поставлена в очередь. Файл появится в разделе <a href="{}">«Выгрузки»</a>.',
+                reverse("admin:base_exportjob_changelist"),
+            ),
+        )
+
+    def export_as_xlsx_background(self, request, queryset):
+        self.export_in_background(request, queryset, "xlsx")
+
+    export_as_xlsx_background.short_description = "Выгрузить .XLSX (в фоне)"
+
+    def export_as_parquet_background(self, request, queryset):
+        self.export_in_background(request, queryset, "parquet")
+
+    export_as_parquet_background.short_description = "Выгрузить .Parquet (в фоне)"
+
+
+class ApproveMixin:
+    """
+    Runs the approval transition when a request is saved as approved and
+    adds the "approve selected" action for storekeepers. `approve_function`
+    (see base.services) approves a queryset and returns (approved, skipped).
+    """
+    approve_function = None
+    
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if not (request.user.is_superuser or is_storekeeper(request)):
+            actions.pop("approve_selected", None)
+        return actions
+    
+    def save_related(self, request, form, formsets, change):
+        # Inlines (images, items) are saved by now, the transition can use them
+        super().save_related(request, form, formsets, change)
+        obj = form.instance
+        if obj.is_approved and not obj.is_archived:
+            approved, skipped = self.approve_function(self.model.objects.filter(pk=obj.pk))
+            if not approved:
+                # The form checked the stock, but it may have changed since:
+                # a request left pending must not be shown as approved
+                self.model.objects.filter(pk=obj.pk, is_archived=False).update(is_approved=False)
+                obj.is_approved = False
+                self.message_user(
+                    request,
+                    "Заявка не подтверждена: она уже в архиве, обрабатывается или недостаточно товара.",
+                    messages.WARNING,
+                )
+    
+    def approve_selected(self, request, queryset):
+        approved, skipped = self.approve_function(queryset)
+        self.message_user(request, f"Подтверждено заявок: {approved}.")
+        if skipped:
+            self.message_user(
+                request,
+                f"Пропущено заявок: {skipped} (уже в архиве, не разрешены, не выбран товар или недостаточно товара).",
+                messages.WARNING,
+            )
+    
+    approve_selected.short_description = "Подтвердить выбранные заявки"
+
+
+class ItemSearchMixin:
+    """
+    Searches the requests by their items with base.search (indexed,
+    ranked) in addition to `search_fields`. `item_search_path` is the
+    lookup from the model to Item; the match is a semi-join, so M2M paths
+    do not duplicate rows.
+    """
+    item_search_path = None
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if not search_term.strip():
+            return results, may_have_duplicates
+        items = search_items(Item.objects.all(), search_term).values("pk")
+        matched = self.model.objects.filter(**{f"{self.item_search_path}__in": items})
+        return results | queryset.filter(pk__in=matched.values("pk")), may_have_duplicates
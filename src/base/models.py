@@ -1,13 +1,21 @@
 from datetime import datetime
 from random import randint
 
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
+from django.contrib.postgres.fields import DateRangeField
+from django.contrib.postgres.search import SearchVectorField
+from django.contrib.postgres.indexes import GinIndex, GistIndex, OpClass
+from django.db.models.functions import Upper
+from django.db.backends.postgresql.psycopg_any import DateRange
 from django.utils.html import mark_safe
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import BaseUserManager, PermissionsMixin
 from django.contrib.auth.base_user import AbstractBaseUser
 
+from base.availability import min_available
+from base.occupancy import OCCUPANCY_FIELDS
+
 
 def get_image_upload_path(instance, filename):
     try:
@@ -31,6 +39,14 @@ def get_consumption_item_image_path(instance, filename):
     return f"items/refund/{instance.id}/{filename}"
 
 
+def get_export_file_path(instance, filename):
+    return f"exports/{instance.id}/{filename}"
+
+
+def get_import_file_path(instance, filename):
+    return f"imports/{timezone.now():%Y/%m/%d}/{filename}"
+
+
 class UserManager(BaseUserManager):
     use_in_migrations = True
     
@@ -221,6 +237,10 @@ class Project(models.Model):
     class Meta:
         verbose_name = "Проект"
         verbose_name_plural = "Проекты"
+        indexes = [
+            # ProjectAdmin.search_fields and "project__name" in the booking search
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="project_name_trgm"),
+        ]
 
 
 class ItemCategory(models.Model):
@@ -315,8 +335,11 @@ class Item(models.Model):
     # TODO: booking end_date
     # TODO: booking project
     # TODO: booking count
-    name = models.CharField(max_length=128, verbose_name="Название*")
+    # Indexed for matching manifest lines by name (base.imports.ItemStockImport)
+    name = models.CharField(max_length=128, db_index=True, verbose_name="Название*")
     description = models.TextField(null=True, blank=True, verbose_name="Описание")
+    # Maintained by a database trigger (see migration 0037), used by base.search
+    search_vector = SearchVectorField(null=True, editable=False)
     
     is_booked = models.BooleanField(
         default=False, 
@@ -324,6 +347,17 @@ class Item(models.Model):
         null=True,
         blank=True,
     )
+    # Maintained by database triggers (see migration 0031), read-only for the application
+    booked_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Забронировано (шт.)",
+    )
+    active_booking_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Активных броней",
+    )
     
     weight = models.DecimalField(
         max_digits=10,
@@ -405,6 +439,11 @@ class Item(models.Model):
         null=True,
     )
     expiration_date = models.DateField(null=True, blank=True, verbose_name="Срок годности (конечная дата)")
+    date_updated = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name="Дата изменения",
+    )
     
     def clean(self):
         pass
@@ -412,10 +451,30 @@ class Item(models.Model):
     
     def save(self, *args, **kwargs):
         self.clean()
-        if self.project and not self.client:
-            self.client = self.project.client
+        self.fill_clients([self])
         super().save(*args, **kwargs)
     
+    @classmethod
+    def fill_clients(cls, items):
+        """Items with a project and no client get the client of the project (one query for all)."""
+        items = [item for item in items if item.project_id and not item.client_id]
+        if not items:
+            return
+        clients = dict(
+            Project.objects.filter(pk__in={item.project_id for item in items}).values_list("pk", "client_id")
+        )
+        for item in items:
+            item.client_id = clients.get(item.project_id)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Compared by the label refresh signal (base.signals.item_label_refresh)
+        instance._loaded_storage_id = instance.__dict__.get("storage_id")
+        # Compared by the occupancy refresh signal (base.signals.item_occupancy_refresh)
+        instance._loaded_occupancy = tuple(instance.__dict__.get(name) for name in OCCUPANCY_FIELDS)
+        return instance
+    
     @property    
     def area(self):
         if self.width and self.length:
@@ -428,6 +487,109 @@ class Item(models.Model):
     class Meta:
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
+        indexes = [
+            # Item search (base.search): trigram indexes for icontains, which is
+            # UPPER(column) LIKE UPPER('%...%') on PostgreSQL, and the full-text vector
+            GinIndex(OpClass(Upper("article"), name="gin_trgm_ops"), name="item_article_trgm"),
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="item_name_trgm"),
+            GinIndex(OpClass(Upper("description"), name="gin_trgm_ops"), name="item_description_trgm"),
+            GinIndex(fields=["search_vector"], name="item_search_vector"),
+        ]
+
+
+class StockMovement(models.Model):
+    """
+    Движение товара (журнал только на добавление).
+    Item.count - остаток, равный сумме движений товара.
+    """
+    KIND_CHOICES = [
+        ("opening", "Начальный остаток"),
+        ("arrival", "Приход"),
+        ("consumption", "Расход"),
+        ("refund", "Возврат"),
+        ("recovery", "Утилизация"),
+        ("adjustment", "Корректировка"),
+    ]
+    
+    item = models.ForeignKey(
+        "base.Item",
+        on_delete=models.CASCADE,
+        related_name="movements",
+        verbose_name="Товар",
+    )
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES, verbose_name="Тип")
+    quantity = models.IntegerField(verbose_name="Количество (+ приход, - списание)")
+    date = models.DateField(default=timezone.localdate, verbose_name="Дата")
+    date_created = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    
+    stock = models.ForeignKey(
+        "base.ItemStock",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="movements",
+        verbose_name="Заявка на приход",
+    )
+    consumption = models.ForeignKey(
+        "base.ItemConsumption",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="movements",
+        verbose_name="Заявка на расход",
+    )
+    refund = models.ForeignKey(
+        "base.ItemRefund",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="movements",
+        verbose_name="Заявка на возврат",
+    )
+    recovery = models.ForeignKey(
+        "base.ItemRecovery",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="movements",
+        verbose_name="Заявка на утилизацию",
+    )
+    
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.item_id} {self.quantity:+d} ({self.date})"
+    
+    class Meta:
+        verbose_name = "Движение товара"
+        verbose_name_plural = "Движения товаров"
+        indexes = [
+            models.Index(fields=["item", "date"], name="stockmovement_item_date"),
+            models.Index(fields=["date"], name="stockmovement_date"),
+        ]
+
+
+class StockSnapshot(models.Model):
+    """
+    Остаток товара на конец дня. Пишется ежедневно для товаров с движениями за день,
+    остаток на любую дату = ближайший снимок + движения после него.
+    """
+    item = models.ForeignKey(
+        "base.Item",
+        on_delete=models.CASCADE,
+        related_name="snapshots",
+        verbose_name="Товар",
+    )
+    date = models.DateField(db_index=True, verbose_name="Дата")
+    balance = models.IntegerField(verbose_name="Остаток")
+    
+    def __str__(self):
+        return f"{self.item_id}: {self.balance} ({self.date})"
+    
+    class Meta:
+        verbose_name = "Остаток на дату"
+        verbose_name_plural = "Остатки на дату"
+        constraints = [
+            models.UniqueConstraint(fields=["item", "date"], name="unique_stock_snapshot"),
+        ]
 
 
 class ItemStock(models.Model):
@@ -550,6 +712,11 @@ class ItemStock(models.Model):
         verbose_name="Архив",
         blank=True,
     )
+    date_updated = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name="Дата изменения",
+    )
 
     def clean(self):
         if self.request_type == 'existing' and not self.existing_item:
@@ -600,16 +767,35 @@ class ItemBooking(models.Model):
         verbose_name="Архив",
         blank=True,
     )
+    # The booking has ended (see services.close_expired_bookings); only approved
+    # bookings not closed hold their items (Item.is_booked and the counters)
+    is_closed = models.BooleanField(default=False, editable=False, verbose_name="Завершена")
+    date_updated = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name="Дата изменения",
+    )
+    # Maintained by base.labels.refresh_labels (see signals)
+    label = models.CharField(max_length=1024, blank=True, default="", editable=False, verbose_name="Название")
     
     def clean(self):
         pass
     
+    @property
+    def period(self):
+        return DateRange(self.start_date, self.end_date, "[]")
+    
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
+        # Reopened when the end date is moved forward
+        self.is_closed = self.end_date < timezone.localdate()
+        # One transaction: on-commit hooks of the signals see the updated lines
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.item_bookings.exclude(period=self.period).update(period=self.period)
     
     def __str__(self):
-        result = f"{self.project.client.name} {self.project.name} {self.start_date}-{self.end_date}"
+        result = self.label
         if self.is_archived:
             result = f"[АРХИВ] {result}"
         return result
@@ -617,6 +803,14 @@ class ItemBooking(models.Model):
     class Meta:
         verbose_name = "Заявка на бронь товаров"
         verbose_name_plural = "Заявки на бронь товаров"
+        indexes = [
+            # Ended bookings still to be closed
+            models.Index(
+                fields=["end_date"],
+                condition=models.Q(is_closed=False),
+                name="booking_open_end_date",
+            ),
+        ]
 
 
 class ItemBookingItemM2M(models.Model):
@@ -633,21 +827,63 @@ class ItemBookingItemM2M(models.Model):
         verbose_name="Заявка на бронь*",
     )
     item_count = models.PositiveIntegerField(default=0, verbose_name="Количество*")
+    # Copy of the booking period, indexed together with the item
+    period = DateRangeField(null=True, blank=True, editable=False, verbose_name="Период брони")
     
     def __str__(self):
         return f"{self.booking}"
     
     def clean(self):
-        if self.item_count > self.item.count:
-            raise ValidationError("Невозможно забронировать больше товара, чем есть на складе")
+        available = min_available(
+            self.item_id, self.booking.start_date, self.booking.end_date, exclude_booking=self.booking.pk,
+        )
+        if self.item_count > available:
+            raise ValidationError(
+                f"Невозможно забронировать больше товара, чем доступно на период брони (доступно: {max(available, 0)})"
+            )
     
     def save(self, *args, **kwargs):
         self.clean()
+        self.period = self.booking.period
         super().save(*args, **kwargs)
     
     class Meta:
         verbose_name = "Товар на бронь"
         verbose_name_plural = "Товары на бронь"
+        indexes = [
+            GistIndex(fields=["item", "period"], name="bookingitem_item_period"),
+        ]
+
+
+class StorageOccupancy(models.Model):
+    """
+    Забронированное (подтверждённые брони) количество и площадь на складе по дням.
+    Пересчитывается при изменении броней и еженощно на OCCUPANCY_HORIZON_DAYS дней вперёд.
+    """
+    storage = models.ForeignKey(
+        "base.Storage",
+        on_delete=models.CASCADE,
+        related_name="occupancy",
+        verbose_name="Склад",
+    )
+    date = models.DateField(verbose_name="Дата")
+    booked_count = models.PositiveIntegerField(default=0, verbose_name="Забронировано (шт.)")
+    booked_area = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        verbose_name="Забронированная площадь (кв.м.)",
+    )
+    
+    def __str__(self):
+        return f"{self.storage_id}: {self.booked_count} ({self.date})"
+    
+    class Meta:
+        verbose_name = "Занятость склада"
+        verbose_name_plural = "Занятость складов"
+        constraints = [
+            models.UniqueConstraint(fields=["storage", "date"], name="unique_storage_occupancy"),
+        ]
 
 
 class RecoveryImage(models.Model):
@@ -712,6 +948,11 @@ class ItemRecovery(models.Model):
         verbose_name="Архив",
         blank=True,
     )
+    date_updated = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name="Дата изменения",
+    )
     
     def clean(self):
         if not self.is_ceo_approved and self.is_approved:
@@ -806,6 +1047,11 @@ class ItemRefund(models.Model):
         verbose_name="Архив",
         blank=True,
     )
+    date_updated = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name="Дата изменения",
+    )
     
     def clean(self):
         pass
@@ -876,10 +1122,29 @@ class ItemConsumption(models.Model):
         verbose_name="Архив",
         blank=True,
     )
+    date_updated = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name="Дата изменения",
+    )
+    # Maintained by base.labels.refresh_labels (see signals)
+    label = models.CharField(max_length=1024, blank=True, default="", editable=False, verbose_name="Название")
+    
+    def clean(self):
+        if not self.is_approved or self.is_archived or not self.booking_id:
+            return
+        short = [
+            f"{line.item} (в брони {line.item_count}, на складе {line.item.count})"
+            for line in self.booking.item_bookings.select_related("item")
+            if line.item_count > line.item.count
+        ]
+        if short:
+            raise ValidationError(
+                f"Невозможно подтвердить расход: товара на складе меньше, чем в брони: {', '.join(short)}"
+            )
     
     def __str__(self):
-        storage = self.booking.items.first().storage
-        result = f"{self.booking.project.client.name} {self.booking.project.name} {self.date_created.date()} {storage}"
+        result = self.label
         if self.is_archived:
             result = f"[АРХИВ] {result}"
         return result
@@ -922,4 +1187,127 @@ class ItemConsumptionImage(models.Model):
     
     class Meta:
         verbose_name = "Фотография товаров"
-        verbose_name_plural = "Фотографии товаров"
\ No newline at end of file
+        verbose_name_plural = "Фотографии товаров"
+
+
+class ExportJob(models.Model):
+    """Фоновая выгрузка"""
+    STATUS_CHOICES = [
+        ("pending", "В очереди"),
+        ("running", "Выполняется"),
+        ("done", "Готово"),
+        ("failed", "Ошибка"),
+    ]
+    FORMAT_CHOICES = [
+        ("xlsx", "XLSX"),
+        ("csv", "CSV"),
+        ("parquet", "Parquet"),
+    ]
+    
+    user = models.ForeignKey(
+        "base.User",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="export_jobs",
+        verbose_name="Пользователь",
+    )
+    model = models.CharField(max_length=64, verbose_name="Данные")
+    format = models.CharField(
+        max_length=16,
+        choices=FORMAT_CHOICES,
+        default="xlsx",
+        verbose_name="Формат",
+    )
+    # Primary keys of the selected changelist rows
+    pks = models.JSONField(default=list, editable=False)
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default="pending",
+        verbose_name="Статус",
+    )
+    progress = models.PositiveIntegerField(default=0, verbose_name="Выгружено строк")
+    total = models.PositiveIntegerField(default=0, verbose_name="Всего строк")
+    file = models.FileField(
+        upload_to=get_export_file_path,
+        null=True,
+        blank=True,
+        verbose_name="Файл",
+    )
+    error = models.TextField(null=True, blank=True, verbose_name="Ошибка")
+    date_created = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    date_finished = models.DateTimeField(null=True, blank=True, verbose_name="Дата завершения")
+    
+    def __str__(self):
+        return f"Выгрузка #{self.id} ({self.get_status_display()})"
+    
+    class Meta:
+        verbose_name = "Выгрузка"
+        verbose_name_plural = "Выгрузки"
+        ordering = ["-date_created"]
+
+
+class ImportJob(models.Model):
+    """Фоновая загрузка из файла"""
+    STATUS_CHOICES = [
+        ("pending", "В очереди"),
+        ("running", "Выполняется"),
+        ("done", "Готово"),
+        ("failed", "Ошибка"),
+    ]
+    
+    user = models.ForeignKey(
+        "base.User",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="import_jobs",
+        verbose_name="Пользователь",
+    )
+    model = models.CharField(max_length=64, verbose_name="Данные*")
+    approve = models.BooleanField(
+        default=False,
+        verbose_name="Сразу подтвердить",
+        help_text="Для заявок на приход: подтвердить все загруженные заявки одной транзакцией",
+    )
+    file = models.FileField(
+        upload_to=get_import_file_path,
+        verbose_name="Файл (.xlsx, .csv)*",
+    )
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default="pending",
+        verbose_name="Статус",
+    )
+    progress = models.PositiveIntegerField(default=0, verbose_name="Обработано строк")
+    created = models.PositiveIntegerField(default=0, verbose_name="Загружено записей")
+    errors = models.TextField(null=True, blank=True, verbose_name="Ошибки")
+    date_created = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    date_finished = models.DateTimeField(null=True, blank=True, verbose_name="Дата завершения")
+    
+    def __str__(self):
+        return f"Загрузка #{self.id} ({self.get_status_display()})"
+    
+    class Meta:
+        verbose_name = "Загрузка"
+        verbose_name_plural = "Загрузки"
+        ordering = ["-date_created"]
+
+
+class ExportCheckpoint(models.Model):
+    """Момент, по который потребитель получил изменения (выгрузка изменений)"""
+    consumer = models.CharField(max_length=128, verbose_name="Потребитель")
+    model = models.CharField(max_length=64, verbose_name="Данные")
+    date_exported = models.DateTimeField(verbose_name="Изменения выгружены по")
+    
+    def __str__(self):
+        return f"{self.consumer}: {self.model} ({self.date_exported})"
+    
+    class Meta:
+        verbose_name = "Отметка выгрузки изменений"
+        verbose_name_plural = "Отметки выгрузки изменений"
+        constraints = [
+            models.UniqueConstraint(fields=["consumer", "model"], name="unique_export_checkpoint"),
+        ]
@@ -0,0 +1,107 @@
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils.timezone import localdate
+
+from base.batches import CommitBatch
+
+
+OCCUPANCY_HORIZON_DAYS = 90
+
+# Item fields the day-grid is computed from
+OCCUPANCY_FIELDS = ("storage_id", "width", "length")
+
+DELETE_OCCUPANCY_SQL = """
+    DELETE FROM base_storageoccupancy
+    WHERE date BETWEEN %(start)s AND %(end)s
+        AND (%(storages)s IS NULL OR storage_id = ANY(%(storages)s))
+"""
+
+INSERT_OCCUPANCY_SQL = """
+    INSERT INTO base_storageoccupancy (storage_id, date, booked_count, booked_area)
+    SELECT item.storage_id, day::date, SUM(line.item_count),
+        COALESCE(SUM(line.item_count * item.width * item.length), 0) / 10000
+    FROM generate_series(%(start)s::date, %(end)s::date, interval '1 day') AS day
+    JOIN base_itembookingitemm2m AS line
+        ON line.period && daterange(%(start)s::date, %(end)s::date, '[]')
+        AND line.period @> day::date
+    JOIN base_itembooking AS booking ON booking.id = line.booking_id AND booking.is_approved
+    JOIN base_item AS item ON item.article = line.item_id
+    WHERE item.storage_id IS NOT NULL
+        AND (%(storages)s IS NULL OR item.storage_id = ANY(%(storages)s))
+    GROUP BY item.storage_id, day
+"""
+
+# Serializes refreshes of the same storage (advisory lock class, storage id)
+OCCUPANCY_LOCK_CLASS = 15
+LOCK_STORAGES_SQL = """
+    SELECT pg_advisory_xact_lock(%(lock_class)s, storage.id::integer) FROM (
+        SELECT id FROM base_storage
+        WHERE %(storages)s IS NULL OR id = ANY(%(storages)s)
+        ORDER BY id
+    ) AS storage
+"""
+
+STORAGES_SQL = "SELECT DISTINCT storage_id FROM base_item WHERE article = ANY(%s) AND storage_id IS NOT NULL"
+
+
+def occupancy_horizon():
+    today = localdate()
+    return today, today + timedelta(days=OCCUPANCY_HORIZON_DAYS - 1)
+
+
+def refresh_occupancy(start=None, end=None, storages=None):
+    """
+    Recomputes the day-grid (booked quantity and area of approved bookings
+    per storage and day) from `start` to `end`, clipped to the horizon,
+    for `storages` (ids) or all storages.
+    """
+    first, last = occupancy_horizon()
+    start, end = max(start or first, first), min(end or last, last)
+    if start > end or storages == []:
+        return
+    params = {"start": start, "end": end, "storages": storages, "lock_class": OCCUPANCY_LOCK_CLASS}
+    with transaction.atomic(), connection.cursor() as cursor:
+        # A concurrent refresh of the same storage would insert the same days
+        cursor.execute(LOCK_STORAGES_SQL, params)
+        cursor.execute(DELETE_OCCUPANCY_SQL, params)
+        cursor.execute(INSERT_OCCUPANCY_SQL, params)
+
+
+def rebuild_occupancy():
+    """Drops the past days and recomputes the whole horizon."""
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM base_storageoccupancy WHERE date < %s", [localdate()])
+    refresh_occupancy()
+
+
+def period_bounds(period):
+    """First and last day of a booking line period ('[]' on instances, '[)' when read back)."""
+    return period.lower, period.upper if period.upper_inc else period.upper - timedelta(days=1)
+
+
+def schedule_occupancy_refresh(articles, start, end, storages=()):
+    """
+    Collects the items and the period touched by a booking change and
+    refreshes their storages once, when the transaction commits.
+    `storages` (ids) are refreshed as well, e.g. the storage an item left.
+    """
+    if start is None or end is None:
+        return
+    pending.add((list(articles), start, end, list(storages)))
+
+
+def flush_occupancy_refresh(changes):
+    articles = {article for change in changes for article in change[0]}
+    storages = {storage_id for change in changes for storage_id in change[3]}
+    with connection.cursor() as cursor:
+        cursor.execute(STORAGES_SQL, [list(articles)])
+        storages.update(storage_id for storage_id, in cursor.fetchall())
+    refresh_occupancy(
+        min(change[1] for change in changes),
+        max(change[2] for change in changes),
+        sorted(storages),
+    )
+
+
+pending = CommitBatch("occupancy_refresh", flush_occupancy_refresh)
@@ -0,0 +1,51 @@
+from django.core.cache import cache
+from django.db import transaction
+
+
+STOREKEEPER = "Кладовщик"
+MANAGER = "Руководитель"
+
+ROLES_CACHE_TIMEOUT = 60 * 60
+
+
+def roles_cache_key(user_id):
+    return f"roles:user:{user_id}"
+
+
+def load_roles(user):
+    """{"groups": group names, "storages": storage ids, "clients": client ids} of `user`."""
+    return {
+        "groups": set(user.groups.values_list("name", flat=True)),
+        "storages": set(user.storages.values_list("pk", flat=True)),
+        "clients": set(user.clients.values_list("pk", flat=True)),
+    }
+
+
+def get_roles(request):
+    """
+    load_roles of the request user, loaded once per request and cached
+    between requests (dropped by the signals on m2m_changed).
+    """
+    if not hasattr(request, "_roles"):
+        key = roles_cache_key(request.user.pk)
+        roles = cache.get(key)
+        if roles is None:
+            roles = load_roles(request.user)
+            cache.set(key, roles, ROLES_CACHE_TIMEOUT)
+        request._roles = roles
+    return request._roles
+
+
+def is_storekeeper(request):
+    return STOREKEEPER in get_roles(request)["groups"]
+
+
+def is_manager(request):
+    return MANAGER in get_roles(request)["groups"]
+
+
+def invalidate_roles(user_ids):
+    """Drops the cached roles of `user_ids` once the transaction commits."""
+    keys = [roles_cache_key(user_id) for user_id in set(user_ids)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
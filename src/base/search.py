@@ -0,0 +1,35 @@
+import re
+
+from django.db.models import F, Q
+from django.contrib.postgres.search import SearchQuery, SearchRank
+
+
+# Text search configuration of Item.search_vector (see migration 0037)
+SEARCH_CONFIG = "russian"
+
+
+def search_query(term):
+    """tsquery matching the items where every word of `term` starts a word."""
+    words = re.findall(r"\w+", term)
+    if not words:
+        return None
+    return SearchQuery(" & ".join(f"{word}:*" for word in words), config=SEARCH_CONFIG, search_type="raw")
+
+
+def search_items(queryset, term):
+    """
+    Items of `queryset` matching `term`, best matches first: full-text on
+    Item.search_vector (article, name, description; GIN index) or a
+    substring of the article, name or description (trigram indexes).
+    """
+    query = search_query(term)
+    if query is None:
+        return queryset.none()
+    return queryset.filter(
+        Q(search_vector=query)
+        | Q(article__icontains=term)
+        | Q(name__icontains=term)
+        | Q(description__icontains=term)
+    ).annotate(
+        search_rank=SearchRank(F("search_vector"), query),
+    ).order_by("-search_rank", "article")
@@ -0,0 +1,237 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils.timezone import localdate, now
+
+from base.exports import bump_export_generation
+from base.models import (
+    Item,
+    ItemImage,
+    ItemStock,
+    ItemRefund,
+    ItemBooking,
+    ItemRecovery,
+    ItemConsumption,
+    ItemRefundItemM2M,
+    StockMovement,
+    ItemBookingItemM2M,
+)
+from base.stock import lock_item_counts, record_movements
+from base.articles import allocate_articles
+from base.availability import invalidate_availability
+from base.occupancy import period_bounds, schedule_occupancy_refresh
+
+
+def claim_pending(queryset, **filters):
+    """
+    Locks the pending (not archived) requests of `queryset` and returns
+    their ids. Already archived or concurrently claimed rows are skipped.
+    """
+    return list(
+        queryset.filter(is_archived=False, **filters)
+        .select_for_update(skip_locked=True, of=("self",))
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+
+def archive_approved(model, ids, **fields):
+    """Marks `ids` approved and archived with one UPDATE."""
+    model.objects.filter(pk__in=ids).update(
+        is_approved=True, is_archived=True, date_updated=now(), **fields,
+    )
+    bump_export_generation(model)
+
+
+def create_stock_items(stocks):
+    """
+    Creates the items of new-item stock requests with one bulk_create
+    (articles allocated together) and moves the request images to them.
+    Returns the items in the order of `stocks`.
+    """
+    items = [
+        Item(
+            article=article,
+            name=stock.new_item_name,
+            description=stock.new_item_description,
+            weight=stock.new_item_weight,
+            height=stock.new_item_height,
+            width=stock.new_item_width,
+            length=stock.new_item_length,
+            count=stock.count,
+            project_id=stock.new_item_project_id,
+            client_id=stock.new_item_client_id,
+            storage_id=stock.new_item_storage_id,
+            category_id=stock.new_item_category_id,
+            arrival_date=stock.new_item_arrival_date,
+            expiration_date=stock.new_item_expiration_date,
+            status_id=stock.new_item_status_id,
+        )
+        for stock, article in zip(stocks, allocate_articles(len(stocks)))
+    ]
+    Item.fill_clients(items)
+    Item.objects.bulk_create(items)
+    stock_items = {stock.pk: item for stock, item in zip(stocks, items)}
+    images = list(ItemImage.objects.filter(item_stock__in=stocks))
+    for image in images:
+        image.item, image.item_stock = stock_items[image.item_stock_id], None
+    ItemImage.objects.bulk_update(images, ["item", "item_stock"])
+    return items
+
+
+@transaction.atomic
+def approve_stocks(queryset):
+    """
+    Approves the stock requests of `queryset`: new items are created with
+    one bulk insert, existing ones get their counts raised by one grouped
+    UPDATE. Requests for an existing item without the item (e.g. deleted
+    since) stay pending. Returns (approved, skipped).
+    """
+    ids = claim_pending(queryset.filter(Q(request_type="new") | Q(existing_item__isnull=False)))
+    today = localdate()
+    stocks = list(ItemStock.objects.filter(pk__in=ids).order_by("pk"))
+    new_stocks = [stock for stock in stocks if stock.request_type == "new"]
+    record_movements([
+        StockMovement(
+            item_id=stock.existing_item_id, kind="arrival",
+            quantity=stock.count, stock=stock, date=stock.date or today,
+        )
+        for stock in stocks
+        if stock.request_type != "new"
+    ])
+    # The count is already set on the new items
+    record_movements([
+        StockMovement(
+            item=item, kind="arrival",
+            quantity=stock.count, stock=stock, date=stock.date or today,
+        )
+        for stock, item in zip(new_stocks, create_stock_items(new_stocks))
+    ], apply=False)
+    archive_approved(ItemStock, ids, date=Coalesce("date", today))
+    if new_stocks:
+        bump_export_generation(Item)
+    return len(ids), queryset.count() - len(ids)
+
+
+@transaction.atomic
+def approve_bookings(queryset):
+    """
+    Approves and archives the booking requests of `queryset`; the database
+    triggers count them in Item.booked_count / active_booking_count /
+    is_booked until close_expired_bookings closes them. Returns (approved, skipped).
+    """
+    ids = claim_pending(queryset)
+    archive_approved(ItemBooking, ids)
+    bump_export_generation(Item)
+    lines = list(ItemBookingItemM2M.objects.filter(booking__in=ids).values_list("item_id", "period"))
+    invalidate_availability(item_id for item_id, period in lines)
+    bounds = [period_bounds(period) for item_id, period in lines if period]
+    if bounds:
+        schedule_occupancy_refresh(
+            [item_id for item_id, period in lines if period],
+            min(start for start, end in bounds),
+            max(end for start, end in bounds),
+        )
+    return len(ids), queryset.count() - len(ids)
+
+
+def close_expired_bookings(today, batch_size=500):
+    """
+    Closes the bookings ended before `today` in batches of `batch_size`,
+    one transaction and one UPDATE per batch (the item booking counters
+    follow through the database triggers). Returns the number of closed bookings.
+    """
+    closed = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                ItemBooking.objects.filter(end_date__lt=today, is_closed=False)
+                .select_for_update(skip_locked=True)
+                .order_by("end_date", "pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                return closed
+            ItemBooking.objects.filter(pk__in=ids).update(is_closed=True, date_updated=now())
+            bump_export_generation(ItemBooking)
+            bump_export_generation(Item)
+        closed += len(ids)
+
+
+@transaction.atomic
+def approve_consumptions(queryset):
+    """
+    Approves the consumption requests of `queryset` and writes the booked
+    quantities off in one grouped UPDATE. Lines not covered by the stock
+    are skipped, as on a single approval. Returns (approved, skipped).
+    """
+    ids = claim_pending(queryset)
+    consumptions = dict(
+        ItemConsumption.objects.filter(pk__in=ids).values_list("pk", "booking_id")
+    )
+    booking_items = list(
+        ItemBookingItemM2M.objects.filter(booking__in=consumptions.values()).order_by("pk")
+    )
+    available = lock_item_counts(booking_item.item_id for booking_item in booking_items)
+    lines = defaultdict(list)
+    for booking_item in booking_items:
+        lines[booking_item.booking_id].append(booking_item)
+
+    movements = []
+    for consumption_id, booking_id in sorted(consumptions.items()):
+        for booking_item in lines[booking_id]:
+            if available[booking_item.item_id] < booking_item.item_count:
+                continue
+            available[booking_item.item_id] -= booking_item.item_count
+            movements.append(StockMovement(
+                item_id=booking_item.item_id, kind="consumption",
+                quantity=-booking_item.item_count, consumption_id=consumption_id,
+            ))
+    record_movements(movements)
+    archive_approved(ItemConsumption, ids)
+    # Consumed bookings no longer hold their items
+    invalidate_availability(available)
+    return len(ids), queryset.count() - len(ids)
+
+
+@transaction.atomic
+def approve_refunds(queryset):
+    """Approves the refund requests of `queryset`. Returns (approved, skipped)."""
+    ids = claim_pending(queryset)
+    record_movements([
+        StockMovement(
+            item_id=refund_item.item_id, kind="refund",
+            quantity=refund_item.item_count, refund_id=refund_item.refund_id,
+        )
+        for refund_item in ItemRefundItemM2M.objects.filter(refund__in=ids).order_by("pk")
+    ])
+    archive_approved(ItemRefund, ids)
+    return len(ids), queryset.count() - len(ids)
+
+
+@transaction.atomic
+def approve_recoveries(queryset):
+    """
+    Approves the recovery requests of `queryset` allowed by the CEO.
+    Requests exceeding the remaining stock stay pending.
+    Returns (approved, skipped).
+    """
+    ids = claim_pending(queryset, is_ceo_approved=True)
+    recoveries = list(ItemRecovery.objects.filter(pk__in=ids).order_by("pk"))
+    available = lock_item_counts(recovery.item_id for recovery in recoveries)
+    today = localdate()
+    movements, approved = [], []
+    for recovery in recoveries:
+        if available[recovery.item_id] < recovery.count:
+            continue
+        available[recovery.item_id] -= recovery.count
+        approved.append(recovery.pk)
+        movements.append(StockMovement(
+            item_id=recovery.item_id, kind="recovery", quantity=-recovery.count,
+            recovery=recovery, date=recovery.date or today,
+        ))
+    record_movements(movements)
+    archive_approved(ItemRecovery, approved, date=Coalesce("date", today))
+    return len(approved), queryset.count() - len(approved)
@@ -1,163 +1,195 @@
-from random import randint
-
-from django.db.models import F
-from django.db import transaction
+from django.apps import apps
 from django.dispatch import receiver
-from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 
 from base.models import (
     Item,
-    ItemStock,
-    ItemRefund,
+    Client,
+    Project,
+    User,
+    Storage,
+    ExportJob,
+    ImportJob,
     ItemBooking,
-    ItemRecovery,
     ItemConsumption,
-    ItemRefundItemM2M,
     ItemBookingItemM2M,
 )
+from base.labels import refresh_labels, schedule_label_refresh
+from base.roles import invalidate_roles
+from base.articles import allocate_articles
+from base.availability import invalidate_availability
+from base.occupancy import OCCUPANCY_FIELDS, occupancy_horizon, period_bounds, schedule_occupancy_refresh
+from base.exports import EXPORTS, bump_export_generation
 
 
 @receiver(pre_save, sender=Item)
 def item_article(sender, instance, **kwargs):
     if not instance.pk:
-        while True:
-            random_number = f"{randint(0, 999999):06}"
-            if not Item.objects.filter(article=random_number).exists():
-                instance.article = random_number
-                break
-
-
-@receiver(post_save, sender=ItemStock)
-def item_stock_approved(sender, instance, created, **kwargs):
-    """
-    Creates (or adds count to existing) Item instance if ItemStock instance is approved.
-    Deletes ItemStock instance if it's approved.
-    """
-    if created:
-        return
-    if instance.request_type != "new":
-        with transaction.atomic():
-            item = instance.existing_item
-            item.count += instance.count
-            item.save()
-            
-            instance.is_archived = True
-            post_save.disconnect(item_stock_approved, sender=ItemStock)
-            instance.save()
-            post_save.connect(item_stock_approved, sender=ItemStock)
-        return
-    
-    if instance.is_approved:
-        with transaction.atomic():
-            item = Item(
-                name=instance.new_item_name,
-                description=instance.new_item_description,
-                weight=instance.new_item_weight,
-                height=instance.new_item_height,
-                width=instance.new_item_width,
-                length=instance.new_item_length,
-                count=instance.count,
-                project=instance.new_item_project,
-                client=instance.new_item_client,
-                storage=instance.new_item_storage,
-                category=instance.new_item_category,
-                arrival_date=instance.new_item_arrival_date,
-                expiration_date=instance.new_item_expiration_date,
-                status=instance.new_item_status,
-            )
-            item.save()
-            for image in instance.images.all():
-                image.item = item
-                image.item_stock = None
-                image.save()
-
-            instance.is_archived = True
-            post_save.disconnect(item_stock_approved, sender=ItemStock)
-            instance.save()
-            post_save.connect(item_stock_approved, sender=ItemStock)
+        instance.article = allocate_articles(1)[0]
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def item_availability_invalidate(sender, instance, **kwargs):
+    invalidate_availability([instance.pk])
+
+
+@receiver(post_save, sender=ItemBooking)
+@receiver(pre_delete, sender=ItemBooking)
+def booking_availability_invalidate(sender, instance, **kwargs):
+    invalidate_availability(instance.item_bookings.values_list("item_id", flat=True))
+
+
+@receiver(pre_save, sender=ItemBookingItemM2M)
+def booking_item_previous_refresh(sender, instance, **kwargs):
+    # The line may be moved to another item
+    if instance.pk:
+        for item_id, period in ItemBookingItemM2M.objects.filter(pk=instance.pk).values_list("item_id", "period"):
+            invalidate_availability([item_id])
+            if period:
+                schedule_occupancy_refresh([item_id], *period_bounds(period))
+
+
+@receiver(post_save, sender=ItemBookingItemM2M)
+@receiver(post_delete, sender=ItemBookingItemM2M)
+def booking_item_availability_invalidate(sender, instance, **kwargs):
+    invalidate_availability([instance.item_id])
+    if instance.period:
+        schedule_occupancy_refresh([instance.item_id], *period_bounds(instance.period))
+
+
+@receiver(post_save, sender=ItemBooking)
+def booking_occupancy_refresh(sender, instance, **kwargs):
+    # The lines still hold the previous period here
+    lines = list(instance.item_bookings.values_list("item_id", "period"))
+    bounds = [(instance.start_date, instance.end_date)]
+    bounds += [period_bounds(period) for item_id, period in lines if period]
+    schedule_occupancy_refresh(
+        [item_id for item_id, period in lines],
+        min(start for start, end in bounds),
+        max(end for start, end in bounds),
+    )
+
+
+@receiver(post_save, sender=ItemConsumption)
+@receiver(post_delete, sender=ItemConsumption)
+def consumption_availability_invalidate(sender, instance, **kwargs):
+    invalidate_availability(
+        ItemBookingItemM2M.objects.filter(booking_id=instance.booking_id).values_list("item_id", flat=True)
+    )
+
+
+@receiver(post_save, sender=ItemBooking)
+def booking_label_refresh(sender, instance, **kwargs):
+    refresh_labels([instance.pk])
+    instance.label = ItemBooking.objects.values_list("label", flat=True).get(pk=instance.pk)
 
 
 @receiver(post_save, sender=ItemConsumption)
-def item_consumption_approved(sender, instance, created, **kwargs):
-    """
-    Отнять кол-во товара в расходе от кол-ва товара на складе
-    Например: Было 10 товаров на складе, подтвердили расход
-        2 (двух), на складе стало 8 товаров
-    """
-    if created:
+def consumption_label_refresh(sender, instance, **kwargs):
+    refresh_labels([instance.booking_id])
+    instance.label = ItemConsumption.objects.values_list("label", flat=True).get(pk=instance.pk)
+
+
+@receiver(post_save, sender=ItemBookingItemM2M)
+@receiver(post_delete, sender=ItemBookingItemM2M)
+def booking_item_label_refresh(sender, instance, **kwargs):
+    # The consumption label shows the storage of the first booked item
+    schedule_label_refresh([instance.booking_id])
+
+
+@receiver(post_save, sender=Project)
+def project_label_refresh(sender, instance, created, **kwargs):
+    if not created:
+        refresh_labels(ItemBooking.objects.filter(project=instance).values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Client)
+def client_label_refresh(sender, instance, created, **kwargs):
+    if not created:
+        refresh_labels(ItemBooking.objects.filter(project__client=instance).values_list("pk", flat=True))
+
+
+# Item created in code, not loaded: its previous storage is unknown
+NOT_LOADED = object()
+
+
+@receiver(post_save, sender=Item)
+def item_label_refresh(sender, instance, created, update_fields, **kwargs):
+    # Only the storage of an item is shown in the labels
+    loaded_storage_id = instance.__dict__.get("_loaded_storage_id", NOT_LOADED)
+    instance._loaded_storage_id = instance.storage_id
+    if created or (update_fields is not None and "storage" not in update_fields):
         return
-    
-    if instance.is_approved:
-        with transaction.atomic():
-            for booking in ItemBookingItemM2M.objects.filter(booking=instance.booking):
-                item = booking.item
-                if item.count - booking.item_count >= 0:
-                    item.count -= booking.item_count
-                    item.save()
-            instance.is_archived = True
-            post_save.disconnect(item_consumption_approved, sender=ItemConsumption)
-            instance.save()
-            post_save.connect(item_consumption_approved, sender=ItemConsumption)
-
-
-@receiver(post_save, sender=ItemRefund)
-def item_refund(sender, instance, created, **kwargs):
-    if created:
+    if loaded_storage_id == instance.storage_id:
         return
-    
-    if instance.is_approved:
-        with transaction.atomic():
-            refund_items = instance.item_refunds.all()
-            for refund_item in refund_items:
-                refund_item.item.count = F("count") + refund_item.item_count
-                refund_item.item.save()
-            instance.is_archived = True
-            post_save.disconnect(item_refund, sender=ItemRefund)
-            instance.save()
-            post_save.connect(item_refund, sender=ItemRefund)
-
-
-@receiver(post_save, sender=ItemRecovery)
-def item_recovery(sender, instance, created, **kwargs):
-    if created:
+    refresh_labels(
+        ItemBooking.objects.filter(item_bookings__item=instance).distinct().values_list("pk", flat=True)
+    )
+
+
+@receiver(post_save, sender=Item)
+def item_occupancy_refresh(sender, instance, created, update_fields, **kwargs):
+    # The day-grid counts the area of approved bookings in the storage of the item
+    loaded = instance.__dict__.get("_loaded_occupancy", NOT_LOADED)
+    instance._loaded_occupancy = tuple(getattr(instance, name) for name in OCCUPANCY_FIELDS)
+    if created or (update_fields is not None and not {"storage", "width", "length"} & set(update_fields)):
+        return
+    if loaded == instance._loaded_occupancy:
         return
-    
-    if instance.is_approved:
-        with transaction.atomic():
-            instance.item.count = F("count") - instance.count
-            instance.item.save()
-            instance.is_archived = True
-            post_save.disconnect(item_recovery, sender=ItemRecovery)
-            instance.save()
-            post_save.connect(item_recovery, sender=ItemRecovery)
+    old_storages = [loaded[0]] if loaded is not NOT_LOADED and loaded[0] is not None else []
+    schedule_occupancy_refresh([instance.pk], *occupancy_horizon(), storages=old_storages)
 
 
-@receiver(post_save, sender=ItemBooking)
-def item_booking(sender, instance, created, **kwargs):
-    if created:
+@receiver(post_save, sender=Storage)
+def storage_label_refresh(sender, instance, created, **kwargs):
+    if not created:
+        refresh_labels(
+            ItemBooking.objects.filter(item_bookings__item__storage=instance).distinct().values_list("pk", flat=True)
+        )
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.storages.through)
+@receiver(m2m_changed, sender=User.clients.through)
+def roles_invalidate(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
         return
+    if not reverse:
+        invalidate_roles([instance.pk])
+    elif pk_set:
+        invalidate_roles(pk_set)
+    else:
+        # Cleared from the group / storage / client side
+        invalidate_roles(
+            sender.objects.filter(**{instance._meta.model_name: instance}).values_list("user_id", flat=True)
+        )
 
-    if instance.is_approved:
-        post_save.disconnect(item_booking, sender=ItemBooking)
 
-        for item in instance.items.all():
-            item.is_booked = True
-            item.save()
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_roles_invalidate(sender, instance, **kwargs):
+    invalidate_roles(instance.user_set.values_list("pk", flat=True))
 
-        instance.is_archived = True
-        instance.save()
 
-        post_save.connect(item_booking, sender=ItemBooking)
+@receiver(pre_delete, sender=Storage)
+@receiver(pre_delete, sender=Client)
+def scope_roles_invalidate(sender, instance, **kwargs):
+    invalidate_roles(instance.users.values_list("pk", flat=True))
 
 
-@receiver(pre_delete, sender=ItemBooking)
-def item_unbooking(sender, instance, **kwargs):
-    for item in instance.items.all():
-        bookings_count = ItemBooking.objects.filter(
-            items=item,
-        ).count()
-        if bookings_count > 1:
-            continue
-        else:
-            item.is_booked = False
-            item.save()
\ No newline at end of file
+@receiver(post_delete, sender=ExportJob)
+@receiver(post_delete, sender=ImportJob)
+def job_file_delete(sender, instance, **kwargs):
+    if instance.file:
+        instance.file.delete(save=False)
+
+
+def export_cache_invalidate(sender, **kwargs):
+    bump_export_generation(sender)
+
+
+for label in {label for export in EXPORTS.values() for label in export().get_models()}:
+    post_save.connect(export_cache_invalidate, sender=apps.get_model(label))
+    post_delete.connect(export_cache_invalidate, sender=apps.get_model(label))
@@ -0,0 +1,156 @@
+from datetime import date, timedelta
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils.timezone import localdate, now
+
+from base.exports import bump_export_generation
+from base.availability import invalidate_availability
+from base.models import Item, StockMovement, StockSnapshot
+
+
+APPLY_DELTAS_SQL = """
+    UPDATE base_item
+    SET count = base_item.count + deltas.quantity, date_updated = %s
+    FROM (VALUES {values}) AS deltas (article, quantity)
+    WHERE base_item.article = deltas.article
+"""
+
+
+def apply_stock_deltas(deltas):
+    """
+    Adds `deltas` ({article: quantity}) to Item.count with a single
+    grouped UPDATE ... FROM (VALUES ...). The count is changed in the
+    database (count = count + delta), so concurrent approvals never
+    overwrite each other.
+    """
+    deltas = {article: delta for article, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    params = [now()]
+    for article, delta in deltas.items():
+        params += [article, delta]
+    values = ", ".join(["(%s, %s)"] * len(deltas))
+    with connection.cursor() as cursor:
+        cursor.execute(APPLY_DELTAS_SQL.format(values=values), params)
+    bump_export_generation(Item)
+    invalidate_availability(deltas)
+
+
+def lock_item_counts(articles):
+    """Locks the items (in primary key order, so concurrent callers cannot deadlock) and returns their counts."""
+    return dict(
+        Item.objects.select_for_update()
+        .filter(pk__in=set(articles))
+        .order_by("pk")
+        .values_list("pk", "count")
+    )
+
+
+def record_movements(movements, apply=True):
+    """
+    Appends `movements` to the ledger and, unless `apply` is False (the
+    count was already written, e.g. for a new Item), moves Item.count by them.
+    """
+    movements = [movement for movement in movements if movement.quantity]
+    StockMovement.objects.bulk_create(movements)
+    rebuild_snapshots(movements)
+    if apply:
+        deltas = defaultdict(int)
+        for movement in movements:
+            deltas[movement.item_id] += movement.quantity
+        apply_stock_deltas(deltas)
+    return movements
+
+
+SNAPSHOT_SQL = """
+    INSERT INTO base_stocksnapshot (item_id, date, balance)
+    SELECT changed.item_id, %(day)s, COALESCE(last.balance, 0) + COALESCE(delta.quantity, 0)
+    FROM (
+        SELECT DISTINCT item_id FROM base_stockmovement WHERE date = %(day)s
+    ) AS changed
+    LEFT JOIN LATERAL (
+        SELECT date, balance FROM base_stocksnapshot
+        WHERE item_id = changed.item_id AND date < %(day)s
+        ORDER BY date DESC
+        LIMIT 1
+    ) AS last ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT SUM(quantity) AS quantity FROM base_stockmovement
+        WHERE item_id = changed.item_id
+            AND date > COALESCE(last.date, '-infinity'::date)
+            AND date <= %(day)s
+    ) AS delta ON TRUE
+    ON CONFLICT (item_id, date) DO UPDATE SET balance = EXCLUDED.balance
+"""
+
+
+def snapshot_balances(day):
+    """Writes end-of-day balances for `day` for every item moved that day."""
+    with connection.cursor() as cursor:
+        cursor.execute(SNAPSHOT_SQL, {"day": day})
+
+
+def rebuild_snapshots(movements):
+    """
+    Backdated `movements` (dated on or before the last snapshot day) make
+    the later snapshots of their items wrong: drops those snapshots and
+    snapshots the affected days again.
+    """
+    last = StockSnapshot.objects.order_by("-date").values_list("date", flat=True).first()
+    if last is None:
+        return
+    earliest = {}
+    for movement in movements:
+        if movement.date <= last:
+            earliest[movement.item_id] = min(movement.date, earliest.get(movement.item_id, movement.date))
+    if not earliest:
+        return
+    stale = Q()
+    for item_id, day in earliest.items():
+        stale |= Q(item_id=item_id, date__gte=day)
+    StockSnapshot.objects.filter(stale).delete()
+    days = (
+        StockMovement.objects.filter(item_id__in=earliest, date__gte=min(earliest.values()), date__lte=last)
+        .order_by("date").values_list("date", flat=True).distinct()
+    )
+    for day in days:
+        snapshot_balances(day)
+
+
+def snapshot_pending_days(until=None):
+    """Snapshots every day after the last snapshot up to `until` (yesterday by default)."""
+    until = until or localdate() - timedelta(days=1)
+    last = StockSnapshot.objects.order_by("-date").values_list("date", flat=True).first()
+    if last is None:
+        last = StockMovement.objects.order_by("date").values_list("date", flat=True).first()
+        if last is None:
+            return
+        last -= timedelta(days=1)
+    day = last + timedelta(days=1)
+    while day <= until:
+        snapshot_balances(day)
+        day += timedelta(days=1)
+
+
+def with_stock_as_of(queryset, day):
+    """
+    Annotates items with `stock_as_of`, their balance at the end of `day`:
+    the nearest snapshot not later than `day` plus the movements after it.
+    """
+    snapshots = StockSnapshot.objects.filter(item=OuterRef("pk"), date__lte=day).order_by("-date")
+    queryset = queryset.annotate(
+        snapshot_date=Subquery(snapshots.values("date")[:1]),
+        snapshot_balance=Subquery(snapshots.values("balance")[:1]),
+    )
+    movements = StockMovement.objects.filter(
+        item=OuterRef("pk"),
+        date__gt=Coalesce(OuterRef("snapshot_date"), Value(date.min)),
+        date__lte=day,
+    ).values("item").annotate(total=Sum("quantity")).values("total")
+    return queryset.annotate(
+        stock_as_of=Coalesce("snapshot_balance", 0) + Coalesce(Subquery(movements), 0),
+    )
+
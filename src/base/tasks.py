@@ -1,16 +1,76 @@
+
 from celery import shared_task
-from django.utils.timezone import now
+from django.apps import apps
+from django.core.files import File
+from django.db.models import F
+from django.utils.timezone import localdate, now
+
+from base import services
+from base.exports import EXPORTS
+from base.imports import IMPORTS, IMPORT_MAX_ERRORS
+from base.models import ExportJob, ImportJob
+from base.stock import snapshot_pending_days
+from base.occupancy import rebuild_occupancy
+
+
+@shared_task
+def close_expired_bookings():
+    return services.close_expired_bookings(localdate())
+
+
+@shared_task
+def run_export_job(job_id):
+    job = ExportJob.objects.get(pk=job_id)
+
+    def progress(count):
+        ExportJob.objects.filter(pk=job.pk).update(progress=count)
+
+    try:
+        export = EXPORTS[job.model]()
+        queryset = apps.get_model(job.model).objects.filter(pk__in=job.pks)
+        ExportJob.objects.filter(pk=job.pk).update(status="running", total=queryset.count())
+        with export.open_file(queryset, job.format, progress) as file:
+            job.file.save(export.get_filename(job.format), File(file), save=False)
+    except Exception as e:
+        ExportJob.objects.filter(pk=job.pk).update(
+            status="failed", error=str(e), date_finished=now(),
+        )
+        raise
 
-from base.models import ItemBooking
+    ExportJob.objects.filter(pk=job.pk).update(
+        status="done", file=job.file.name, progress=F("total"), date_finished=now(),
+    )
 
 
 @shared_task
-def archive_expired_bookings():
-    today = now().date()
-    expired_bookings = ItemBooking.objects.filter(end_date__lt=today, is_archived=False)
-    
-    for booking in expired_bookings:
-        booking.is_archived = True
-        booking.save()
-        
-        booking.items.update(is_booked=False)
\ No newline at end of file
+def snapshot_stock_balances():
+    snapshot_pending_days()
+
+
+@shared_task
+def rebuild_storage_occupancy():
+    rebuild_occupancy()
+
+
+@shared_task
+def run_import_job(job_id):
+    job = ImportJob.objects.get(pk=job_id)
+    ImportJob.objects.filter(pk=job.pk).update(status="running")
+
+    def progress(count):
+        ImportJob.objects.filter(pk=job.pk).update(progress=count)
+
+    try:
+        with job.file.open("rb") as file:
+            created, errors = IMPORTS[job.model](approve=job.approve).run(file, job.file.name, progress)
+    except Exception as e:
+        ImportJob.objects.filter(pk=job.pk).update(
+            status="failed", errors=str(e), date_finished=now(),
+        )
+        raise
+
+    if len(errors) > IMPORT_MAX_ERRORS:
+        errors = errors[:IMPORT_MAX_ERRORS] + [f"... и ещё {len(errors) - IMPORT_MAX_ERRORS} строк с ошибками"]
+    ImportJob.objects.filter(pk=job.pk).update(
+        status="done", created=created, errors="\n".join(errors) or None, date_finished=now(),
+    )
@@ -1,3 +1,752 @@
-from django.test import TestCase
+import io
+import csv
+import shutil
+import tempfile
+import threading
+from decimal import Decimal
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+import pyarrow.parquet as pq
+
+from django.contrib.admin import site
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import localdate, now
+
+from base import availability, models, occupancy, services, tasks
+from base.imports import ItemStockImport
+from base.exports import (
+    ItemExport,
+    ItemBookingExport,
+    export_delta,
+    plan_related,
+    bump_export_generation,
+    get_export_generation,
+)
+from base.stock import record_movements, snapshot_pending_days, with_stock_as_of
+
+
+class ItemTestCase(TestCase):
+    """A storage holding one item."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.storage = models.Storage.objects.create(name="Склад", area=100, free_area=50)
+        cls.item = models.Item.objects.create(name="Стул", count=10, storage=cls.storage)
+
+
+class ItemAdminSearchTests(ItemTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.table = models.Item.objects.create(name="Стол письменный", count=1, storage=cls.storage)
+        cls.user = models.User.objects.create_superuser("admin", "password")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_changelist_without_search_lists_items(self):
+        response = self.client.get("/admin/base/item/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["cl"].result_count, 2)
+
+    def test_changelist_search(self):
+        response = self.client.get("/admin/base/item/", {"q": "Стул"})
+        self.assertEqual(list(response.context["cl"].result_list), [self.item])
+
+    def test_autocomplete_without_term_lists_items(self):
+        response = self.client.get("/admin/autocomplete/", {
+            "term": "",
+            "app_label": "base",
+            "model_name": "itembookingitemm2m",
+            "field_name": "item",
+        })
+        self.assertEqual(len(response.json()["results"]), 2)
+
+
+class ItemAdminCountTests(ItemTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = models.User.objects.create_superuser("admin", "password")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post_change_form(self, count):
+        url = f"/admin/base/item/{self.item.pk}/change/"
+        form = self.client.get(url).context["adminform"].form
+        data = {key: value for key, value in form.initial.items() if value is not None}
+        data.update({
+            "count": count,
+            "initial-count": form.initial["count"],
+            "images-TOTAL_FORMS": 0,
+            "images-INITIAL_FORMS": 0,
+        })
+        # An approval moves the count while the form is open
+        models.Item.objects.filter(pk=self.item.pk).update(count=15)
+        return self.client.post(url, data)
+
+    def test_edit_is_an_adjustment_against_the_current_count(self):
+        response = self.post_change_form(12)
+        self.assertEqual(response.status_code, 302)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.count, 12)
+        self.assertEqual(
+            list(models.StockMovement.objects.filter(item=self.item, kind="adjustment").values_list("quantity", flat=True)),
+            [-3],
+        )
+
+    def test_untouched_count_is_kept(self):
+        response = self.post_change_form(10)
+        self.assertEqual(response.status_code, 302)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.count, 15)
+        self.assertFalse(models.StockMovement.objects.filter(item=self.item, kind="adjustment").exists())
+
+
+class RequestChangelistQueryTests(ItemTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = models.User.objects.create_superuser("admin", "password")
+        project = models.Project.objects.create(name="Проект", client=models.Client.objects.create(name="Клиент"))
+        # Run the scheduled label refresh: the changelists show the stored labels
+        with cls.captureOnCommitCallbacks(execute=True):
+            for number in range(2):
+                models.ItemStock.objects.create(request_type="existing", existing_item=cls.item, count=1)
+                booking = models.ItemBooking.objects.create(
+                    project=project, city="Москва", start_date=localdate(), end_date=localdate() + timedelta(days=2),
+                )
+                models.ItemBookingItemM2M.objects.create(booking=booking, item=cls.item, item_count=1)
+                models.ItemConsumption.objects.create(booking=booking, city="Москва")
+                models.ItemRecovery.objects.create(item=cls.item, reason="Брак", planning_date=localdate(), count=1)
+                refund = models.ItemRefund.objects.create(project=project, city="Москва", date=localdate())
+                models.ItemRefundItemM2M.objects.create(refund=refund, item=cls.item, item_count=1)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_changelists_do_not_query_per_row(self):
+        for model in ["itemstock", "itembooking", "itemrecovery", "itemrefund", "itemconsumption"]:
+            with self.subTest(model=model), self.assertNumQueries(5):
+                response = self.client.get(f"/admin/base/{model}/")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context["cl"].result_list), 2)
+
+
+class BackdatedMovementTests(ItemTestCase):
+    def test_backdated_approval_reaches_existing_snapshots(self):
+        today = localdate()
+        item = self.item
+        record_movements([
+            models.StockMovement(item=item, kind="arrival", quantity=10, date=today - timedelta(days=5)),
+            models.StockMovement(item=item, kind="arrival", quantity=1, date=today - timedelta(days=1)),
+        ])
+        snapshot_pending_days()
+        stock = models.ItemStock.objects.create(
+            request_type="existing", existing_item=item, count=4, date=today - timedelta(days=3),
+        )
+        services.approve_stocks(models.ItemStock.objects.filter(pk=stock.pk))
+
+        def stock_as_of(day):
+            return with_stock_as_of(models.Item.objects.filter(pk=item.pk), day).get().stock_as_of
+
+        self.assertEqual(stock_as_of(today - timedelta(days=4)), 10)
+        self.assertEqual(stock_as_of(today - timedelta(days=3)), 14)
+        self.assertEqual(stock_as_of(today - timedelta(days=1)), 15)
+        self.assertEqual(stock_as_of(today), 15)
+        self.assertEqual(models.StockSnapshot.objects.get(item=item, date=today - timedelta(days=1)).balance, 15)
+
+
+class StockAsOfViewTests(ItemTestCase):
+    def setUp(self):
+        self.client.force_login(models.User.objects.create_user("manager", "password", is_staff=True))
+        record_movements([models.StockMovement(item=self.item, kind="opening", quantity=10)], apply=False)
+
+    def test_item_stock(self):
+        response = self.client.get(f"/utils/stock_as_of/{localdate()}/", {"item_id": self.item.pk})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["items"], [
+            {"article": self.item.pk, "name": "Стул", "current_storage": "Склад", "stock": 10},
+        ])
+
+    def test_storage_history_is_rejected(self):
+        for storage_id in ["abc", str(self.storage.pk)]:
+            response = self.client.get(f"/utils/stock_as_of/{localdate()}/", {"storage_id": storage_id})
+            self.assertEqual(response.status_code, 400)
+
+
+class ApproveStocksTests(ItemTestCase):
+    def test_existing_item_request_without_item_is_skipped(self):
+        models.ItemStock.objects.create(request_type="existing", existing_item=self.item, count=4)
+        orphan = models.ItemStock.objects.create(request_type="existing", count=5)
+
+        approved, skipped = services.approve_stocks(models.ItemStock.objects.all())
+
+        self.assertEqual((approved, skipped), (1, 1))
+        orphan.refresh_from_db()
+        self.assertFalse(orphan.is_archived)
+        self.assertFalse(models.StockMovement.objects.filter(stock=orphan).exists())
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.count, 14)
+
+
+class ApproveMixinTests(ItemTestCase):
+    def test_skipped_request_is_not_left_approved(self):
+        recovery = models.ItemRecovery.objects.create(
+            item=self.item, reason="Брак", planning_date=localdate(), count=5, is_ceo_approved=True,
+        )
+        # Saved as approved, but the stock was written off after the form was checked
+        models.ItemRecovery.objects.filter(pk=recovery.pk).update(is_approved=True)
+        models.Item.objects.filter(pk=self.item.pk).update(count=2)
+        recovery.is_approved = True
+        model_admin = site._registry[models.ItemRecovery]
+
+        with mock.patch.object(model_admin, "message_user") as message_user:
+            model_admin.save_related(None, mock.Mock(instance=recovery), [], True)
+
+        message_user.assert_called_once()
+        recovery.refresh_from_db()
+        self.assertEqual((recovery.is_approved, recovery.is_archived), (False, False))
+        self.assertFalse(models.StockMovement.objects.filter(recovery=recovery).exists())
+
+    def test_consumption_exceeding_the_stock_cannot_be_approved(self):
+        project = models.Project.objects.create(name="Проект")
+        booking = models.ItemBooking.objects.create(
+            project=project, start_date=localdate(), end_date=localdate() + timedelta(days=2),
+        )
+        models.ItemBookingItemM2M.objects.create(booking=booking, item=self.item, item_count=4)
+        models.Item.objects.filter(pk=self.item.pk).update(count=3)
+        consumption = models.ItemConsumption(booking=booking, city="Москва", is_approved=True)
+
+        with self.assertRaises(ValidationError):
+            consumption.clean()
+
+
+class BookingApprovalTests(ItemTestCase):
+    def test_approval_archives_once_and_closing_keeps_the_archive(self):
+        project = models.Project.objects.create(name="Проект")
+        booking = models.ItemBooking.objects.create(
+            project=project, start_date=localdate(), end_date=localdate() + timedelta(days=2), is_approved=True,
+        )
+        bookings = models.ItemBooking.objects.filter(pk=booking.pk)
+
+        self.assertEqual(services.approve_bookings(bookings), (1, 0))
+        self.assertEqual(services.approve_bookings(bookings), (0, 1))
+        booking.refresh_from_db()
+        self.assertEqual((booking.is_archived, booking.is_closed), (True, False))
+
+        self.assertEqual(services.close_expired_bookings(localdate() + timedelta(days=3)), 1)
+        booking.refresh_from_db()
+        self.assertEqual((booking.is_archived, booking.is_closed), (True, True))
+
+
+class BookingCounterTests(ItemTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.project = models.Project.objects.create(name="Проект")
+
+    def book(self, count, is_approved=True):
+        booking = models.ItemBooking.objects.create(
+            project=self.project, start_date=localdate(), end_date=localdate() + timedelta(days=2),
+            is_approved=is_approved,
+        )
+        return models.ItemBookingItemM2M.objects.create(booking=booking, item=self.item, item_count=count)
+
+    def assertCounters(self, booked_count, active_booking_count):
+        self.item.refresh_from_db()
+        self.assertEqual(
+            (self.item.booked_count, self.item.active_booking_count, self.item.is_booked),
+            (booked_count, active_booking_count, active_booking_count > 0),
+        )
+
+    def test_lines_of_approved_bookings(self):
+        line = self.book(3)
+        self.assertCounters(3, 1)
+        self.book(2)
+        self.assertCounters(5, 2)
+
+        line.item_count = 1
+        line.save()
+        self.assertCounters(3, 2)
+
+        line.delete()
+        self.assertCounters(2, 1)
+
+    def test_pending_booking_is_counted_once_approved(self):
+        line = self.book(3, is_approved=False)
+        self.assertCounters(0, 0)
+
+        services.approve_bookings(models.ItemBooking.objects.filter(pk=line.booking_id))
+        self.assertCounters(3, 1)
+
+        line.booking.delete()
+        self.assertCounters(0, 0)
+
+    def test_closed_booking_releases_the_item(self):
+        self.book(3)
+        services.approve_bookings(models.ItemBooking.objects.all())
+        self.assertCounters(3, 1)
+
+        services.close_expired_bookings(localdate() + timedelta(days=3))
+        self.assertCounters(0, 0)
+
+    def test_counters_are_written_by_the_triggers_only(self):
+        self.book(3)
+        models.Item.objects.filter(pk=self.item.pk).update(booked_count=99, active_booking_count=0, is_booked=False)
+        self.item.name = "Кресло"
+        self.item.save()
+        self.assertCounters(3, 1)
+
+
+class ExportGenerationTests(TestCase):
+    def test_generation_is_bumped_on_commit(self):
+        before = get_export_generation("base.item")
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_export_generation(models.Item)
+            self.assertEqual(get_export_generation("base.item"), before)
+        self.assertNotEqual(get_export_generation("base.item"), before)
+
+
+class ExportTests(ItemTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        project = models.Project.objects.create(name="Проект")
+        for days in range(3):
+            booking = models.ItemBooking.objects.create(
+                project=project, start_date=localdate(), end_date=localdate() + timedelta(days=days),
+            )
+            models.ItemBookingItemM2M.objects.create(booking=booking, item=cls.item, item_count=1)
+
+    def setUp(self):
+        self.cache_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_root)
+        settings = override_settings(EXPORT_CACHE_ROOT=self.cache_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_plan_related(self):
+        self.assertEqual(
+            plan_related(models.ItemBooking, ["items", "items__storage", "project__name"]),
+            (["project"], ["items__storage"]),
+        )
+
+    def test_queries_do_not_depend_on_rows(self):
+        file = io.BytesIO()
+        # Bookings with their projects, then the items and their storages prefetched
+        with self.assertNumQueries(3):
+            ItemBookingExport().write_csv(models.ItemBooking.objects.all(), file)
+        rows = list(csv.reader(io.StringIO(file.getvalue().decode())))
+        self.assertEqual(len(rows), 4)
+        self.assertIn("[Склад]", rows[1][0])
+
+    def test_cached_file_is_replaced_after_a_change(self):
+        export = ItemBookingExport()
+        queryset = models.ItemBooking.objects.all()
+        with export.open_file(queryset, "csv") as file:
+            first = file.name
+        with mock.patch.object(export, "write_csv") as write, export.open_file(queryset, "csv") as file:
+            self.assertEqual(file.name, first)
+        write.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.name = "Склад 2"
+            self.storage.save()
+        with export.open_file(queryset, "csv") as file:
+            self.assertNotEqual(file.name, first)
+            self.assertIn("[Склад 2]", file.read().decode())
+
+    def test_parquet(self):
+        file = io.BytesIO()
+        ItemExport().write_parquet(models.Item.objects.all(), file)
+        file.seek(0)
+        table = pq.read_table(file)
+        self.assertEqual(table.column_names, ItemExport().headers)
+        self.assertEqual(table.column("Артикул").to_pylist(), [self.item.article])
+
+    def test_empty_parquet(self):
+        file = io.BytesIO()
+        ItemExport().write_parquet(models.Item.objects.none(), file)
+        file.seek(0)
+        self.assertEqual(pq.read_table(file).num_rows, 0)
+
+    def test_delta_export_moves_the_checkpoint(self):
+        other = models.Item.objects.create(name="Стол", count=1, storage=self.storage)
+        self.assertEqual(export_delta(ItemExport, "erp", "csv", io.BytesIO()), 2)
+
+        # Everything was exported well before the checkpoint, then one item changes
+        models.Item.objects.update(date_updated=now() - timedelta(days=1))
+        models.ItemBooking.objects.update(date_updated=now() - timedelta(days=1))
+        models.ExportCheckpoint.objects.update(date_exported=now() - timedelta(hours=1))
+        other.name = "Стол письменный"
+        other.save()
+
+        file = io.BytesIO()
+        self.assertEqual(export_delta(ItemExport, "erp", "csv", file), 1)
+        self.assertIn("Стол письменный", file.getvalue().decode())
+        checkpoint = models.ExportCheckpoint.objects.get(consumer="erp", model="base.item")
+        self.assertGreater(checkpoint.date_exported, now() - timedelta(minutes=1))
+
+
+class DeltaExportBookingTests(ItemTestCase):
+    def setUp(self):
+        project = models.Project.objects.create(name="Проект")
+        self.booking = models.ItemBooking.objects.create(
+            project=project, start_date=localdate(), end_date=localdate() + timedelta(days=2), is_approved=True,
+        )
+        models.ItemBookingItemM2M.objects.create(booking=self.booking, item=self.item, item_count=1)
+        export_delta(ItemExport, "erp", "csv", io.BytesIO())
+        # The export ran well after these changes
+        models.Item.objects.update(date_updated=now() - timedelta(days=1))
+        models.ItemBooking.objects.update(date_updated=now() - timedelta(days=1))
+        models.ExportCheckpoint.objects.update(date_exported=now() - timedelta(hours=1))
+
+    def test_deleted_booking_exports_the_item(self):
+        self.booking.delete()
+        self.assertEqual(export_delta(ItemExport, "erp", "csv", io.BytesIO()), 1)
+
+    def test_closed_booking_exports_the_item(self):
+        services.close_expired_bookings(localdate() + timedelta(days=3))
+        models.ItemBooking.objects.update(date_updated=now() - timedelta(days=1))
+        self.assertEqual(export_delta(ItemExport, "erp", "csv", io.BytesIO()), 1)
+
+
+class ExportJobAdminTests(TestCase):
+    def test_staff_sees_own_jobs(self):
+        user = models.User.objects.create_user("manager", "password", is_staff=True)
+        other = models.User.objects.create_user("other", "password", is_staff=True)
+        job = models.ExportJob.objects.create(user=user, model="base.item")
+        models.ExportJob.objects.create(user=other, model="base.item")
+        self.client.force_login(user)
+
+        response = self.client.get("/admin/base/exportjob/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["cl"].result_list), [job])
+
+
+class ExportJobTests(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(MEDIA_ROOT=root, EXPORT_CACHE_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_exports_the_selected_rows(self):
+        item = models.Item.objects.create(name="Стул", count=10)
+        models.Item.objects.create(name="Стол", count=5)
+        job = models.ExportJob.objects.create(model="base.item", format="csv", pks=[item.pk])
+
+        tasks.run_export_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total, job.progress), ("done", 1, 1))
+
+    def test_failed_setup_marks_the_job_failed(self):
+        job = models.ExportJob.objects.create(model="base.missing", pks=[1])
+
+        with self.assertRaises(KeyError):
+            tasks.run_export_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertTrue(job.error)
+
+
+class ImportJobAdminTests(TestCase):
+    def test_imports_follow_the_add_permission_of_the_target(self):
+        user = models.User.objects.create_user("storekeeper", "password", is_staff=True)
+        self.client.force_login(user)
+        self.assertEqual(self.client.get("/admin/base/importjob/add/").status_code, 403)
+
+        user.user_permissions.add(Permission.objects.get(codename="add_itemstock"))
+        response = self.client.get("/admin/base/importjob/add/")
+        self.assertEqual(response.status_code, 200)
+        choices = response.context["adminform"].form.fields["model"].choices
+        self.assertEqual([label for label, title in choices], ["base.itemstock"])
+
+        response = self.client.post("/admin/base/importjob/add/", {
+            "model": "base.item",
+            "file": SimpleUploadedFile("items.csv", "Название;Количество;Склад\n".encode()),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(models.ImportJob.objects.exists())
+
+
+class ItemStockImportTests(ItemTestCase):
+    def test_numeric_article_cell_keeps_leading_zeros(self):
+        item = models.Item.objects.create(article="000123", name="Кресло", count=1, storage=self.storage)
+        workbook = openpyxl.Workbook()
+        workbook.active.append(["Артикул", "Количество"])
+        workbook.active.append([123, 5])
+        file = io.BytesIO()
+        workbook.save(file)
+        file.seek(0)
+
+        created, errors = ItemStockImport().run(file, "manifest.xlsx")
+
+        self.assertEqual((created, errors), (1, []))
+        self.assertEqual(models.ItemStock.objects.get().existing_item, item)
+
+    def test_new_item_line_requires_storage(self):
+        file = io.BytesIO("Название;Количество;Склад\nКресло;5;\nСтол;2;Склад\n".encode())
+
+        created, errors = ItemStockImport().run(file, "manifest.csv")
+
+        self.assertEqual(created, 1)
+        self.assertEqual(errors, ["Строка 2: товар «Кресло» не найден, для нового товара укажите склад"])
+        self.assertEqual(models.ItemStock.objects.get().new_item_name, "Стол")
+
+    def test_lines_of_the_same_new_item_make_one_request(self):
+        file = io.BytesIO("Название;Количество;Склад\nКресло;5;Склад\nСтол;2;Склад\nКресло;3;\n".encode())
+
+        created, errors = ItemStockImport().run(file, "manifest.csv")
+
+        self.assertEqual((created, errors), (2, []))
+        self.assertEqual(
+            sorted(models.ItemStock.objects.values_list("new_item_name", "count")),
+            [("Кресло", 8), ("Стол", 2)],
+        )
+
+    def test_new_item_gets_the_client_of_its_project(self):
+        client = models.Client.objects.create(name="Клиент")
+        models.Project.objects.create(name="Проект", client=client)
+        file = io.BytesIO("Название;Количество;Склад;Проект\nКресло;5;Склад;Проект\n".encode())
+
+        ItemStockImport(approve=True).run(file, "manifest.csv")
+
+        self.assertEqual(models.Item.objects.get(name="Кресло").client, client)
+
+
+class CheckItemBookingsTests(TestCase):
+    def test_requires_staff(self):
+        response = self.client.get("/utils/check_item_bookings/", {"item_id": "000001"})
+        self.assertEqual(response.status_code, 302)
+
+    def test_item_endpoints_require_staff(self):
+        for url in ["/utils/get_item_booking/?item_id=000001", "/utils/check_item_booking/000001/2024-01-01/2024-01-02/"]:
+            self.assertEqual(self.client.get(url).status_code, 302)
+
+
+class AvailabilityTests(ItemTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.project = models.Project.objects.create(name="Проект")
+        cls.today = localdate()
+
+    def book(self, start, end, count):
+        booking = models.ItemBooking.objects.create(
+            project=self.project,
+            start_date=self.today + timedelta(days=start),
+            end_date=self.today + timedelta(days=end),
+        )
+        return models.ItemBookingItemM2M.objects.create(booking=booking, item=self.item, item_count=count)
+
+    def test_overlapping_bookings_are_counted_per_day(self):
+        self.book(-3, -1, 10)
+        self.book(0, 2, 4)
+        self.book(2, 4, 3)
+
+        days = availability.available_quantities([self.item.pk], self.today, self.today + timedelta(days=5))
+
+        self.assertEqual(list(days[self.item.pk].values()), [6, 6, 3, 7, 7, 10])
+
+    def test_bookings_cannot_oversubscribe_a_period(self):
+        self.book(0, 2, 6)
+        start, end = self.today + timedelta(days=1), self.today + timedelta(days=3)
+
+        with self.assertRaises(ValidationError):
+            availability.reserve_items({self.item.pk: 5}, start, end)
+        with self.assertRaises(ValidationError):
+            self.book(1, 3, 5)
+        availability.reserve_items({self.item.pk: 4}, start, end)
+        self.book(3, 5, 10)
+        self.assertEqual(availability.min_available(self.item.pk, self.today, self.today + timedelta(days=5)), 0)
+
+    def test_cache_is_invalidated_by_a_booking_line_change(self):
+        line = self.book(0, 2, 4)
+        self.assertEqual(availability.get_item_states([self.item.pk])[self.item.pk]["lines"][0][3], 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            line.item_count = 7
+            line.save()
+
+        state = availability.get_item_states([self.item.pk])[self.item.pk]
+        self.assertEqual([line[3] for line in state["lines"]], [7])
+        days = availability.cached_available_quantities(
+            {self.item.pk: state}, self.today, self.today + timedelta(days=3),
+        )[self.item.pk]
+        self.assertEqual(list(days.values()), [3, 3, 3, 10])
+
+
+class AvailabilityCacheTests(ItemTestCase):
+    def test_state_loaded_before_invalidation_is_not_served(self):
+        item = self.item
+        # A reader computes the keys and loads the state before a writer commits
+        keys = availability.get_availability_keys([item.pk])
+        stale = availability.load_item_states([item.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Item.objects.filter(pk=item.pk).update(count=7)
+            availability.invalidate_availability([item.pk])
+        # ... and stores it after the invalidation
+        cache.set_many({key: stale[article] for key, article in keys.items()})
+
+        self.assertEqual(availability.get_item_states([item.pk])[item.pk]["stock"], 7)
+
+
+class ReservationTests(TransactionTestCase):
+    def setUp(self):
+        self.item = models.Item.objects.create(name="Стул", count=10)
+        self.project = models.Project.objects.create(name="Проект")
+        self.start, self.end = localdate(), localdate() + timedelta(days=2)
+
+    def test_requires_a_transaction(self):
+        with self.assertRaises(transaction.TransactionManagementError):
+            availability.reserve_items({self.item.pk: 1}, self.start, self.end)
+
+    def test_concurrent_reservations_of_an_item(self):
+        errors = []
+
+        def reserve():
+            try:
+                with transaction.atomic():
+                    availability.reserve_items({self.item.pk: 6}, self.start, self.end)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            availability.reserve_items({self.item.pk: 6}, self.start, self.end)
+            booking = models.ItemBooking.objects.create(project=self.project, start_date=self.start, end_date=self.end)
+            models.ItemBookingItemM2M.objects.create(booking=booking, item=self.item, item_count=6)
+            thread = threading.Thread(target=reserve)
+            thread.start()
+            # The second reservation waits for the item lock held by this one
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+        thread.join()
+
+        # ...and then sees the booking saved by this one
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], ValidationError)
+        self.assertIn("доступно на период брони 4", errors[0].messages[0])
+
+
+class OccupancyRefreshTests(TransactionTestCase):
+    def setUp(self):
+        self.storage = models.Storage.objects.create(name="Склад", area=100, free_area=50)
+        self.item = models.Item.objects.create(name="Стул", count=10, storage=self.storage)
+        project = models.Project.objects.create(name="Проект")
+        booking = models.ItemBooking.objects.create(
+            project=project, start_date=localdate(), end_date=localdate() + timedelta(days=2), is_approved=True,
+        )
+        models.ItemBookingItemM2M.objects.create(booking=booking, item=self.item, item_count=2)
+
+    def test_concurrent_refreshes_of_a_storage(self):
+        errors = []
+
+        def refresh():
+            try:
+                occupancy.refresh_occupancy(storages=[self.storage.pk])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            occupancy.refresh_occupancy(storages=[self.storage.pk])
+            thread = threading.Thread(target=refresh)
+            thread.start()
+            # The second refresh waits for this transaction
+            thread.join(0.5)
+        thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(models.StorageOccupancy.objects.filter(storage=self.storage).count(), 3)
+
+    def test_rolled_back_refresh_is_not_carried_over(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            occupancy.schedule_occupancy_refresh(["000001"], localdate(), localdate())
+            raise ValueError
+        with transaction.atomic():
+            occupancy.schedule_occupancy_refresh(["000002"], localdate(), localdate())
+            self.assertEqual(occupancy.pending.values, [(["000002"], localdate(), localdate(), [])])
+
+    def test_item_moved_to_another_storage(self):
+        other_storage = models.Storage.objects.create(name="Склад 2", area=100, free_area=50)
+        item = models.Item.objects.get()
+        item.storage = other_storage
+        item.save()
+
+        self.assertFalse(models.StorageOccupancy.objects.filter(storage=self.storage).exists())
+        self.assertEqual(
+            list(models.StorageOccupancy.objects.filter(storage=other_storage).values_list("booked_count", flat=True)),
+            [2, 2, 2],
+        )
+
+    def test_item_dimensions_change(self):
+        item = models.Item.objects.get()
+        item.width, item.length = 50, 100
+        item.save(update_fields=["width", "length"])
+
+        self.assertEqual(
+            {row.booked_area for row in models.StorageOccupancy.objects.filter(storage=self.storage)},
+            {Decimal("1")},
+        )
+
+
+class ItemLabelRefreshTests(ItemTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_storage = models.Storage.objects.create(name="Склад 2", area=100, free_area=50)
+        project = models.Project.objects.create(name="Проект")
+        # Run the scheduled label refresh: the tests schedule their own
+        with cls.captureOnCommitCallbacks(execute=True):
+            booking = models.ItemBooking.objects.create(
+                project=project, start_date=localdate(), end_date=localdate() + timedelta(days=2),
+            )
+            models.ItemBookingItemM2M.objects.create(booking=booking, item=cls.item, item_count=1)
+            cls.consumption = models.ItemConsumption.objects.create(booking=booking, city="Москва")
+
+    def label_updates(self, save):
+        with CaptureQueriesContext(connection) as queries:
+            save()
+        return [query["sql"] for query in queries if "SET label" in query["sql"]]
+
+    def test_save_without_storage_change_does_not_refresh(self):
+        item = models.Item.objects.get()
+        item.name = "Кресло"
+        self.assertEqual(self.label_updates(item.save), [])
+        self.assertEqual(self.label_updates(lambda: item.save(update_fields=["count"])), [])
+
+    def test_booking_lines_refresh_labels_once(self):
+        booking = self.consumption.booking
+
+        def save_lines():
+            with self.captureOnCommitCallbacks(execute=True):
+                for count in range(1, 4):
+                    models.ItemBookingItemM2M.objects.create(booking=booking, item=self.item, item_count=count)
+
+        # One UPDATE of the booking labels, one of the consumption labels
+        self.assertEqual(len(self.label_updates(save_lines)), 2)
+
+    def test_storage_change_refreshes_labels(self):
+        item = models.Item.objects.get()
+        item.storage = self.other_storage
+        self.assertNotEqual(self.label_updates(item.save), [])
+        self.consumption.refresh_from_db()
+        self.assertIn("Склад 2", self.consumption.label)
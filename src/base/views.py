@@ -1,35 +1,120 @@
-from django.http import JsonResponse
+import datetime
+
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import get_object_or_404
+from django.contrib.admin.views.decorators import staff_member_required
 
-from base.models import Item, ItemBooking
+from base.models import ExportJob, Item
+from base.availability import cached_available_quantities, get_item_states
+from base.stock import with_stock_as_of
 
 
+@staff_member_required
 def get_item_booking(request):
     item_id = request.GET.get('item_id')
     if item_id:
-        try:
-            item = Item.objects.get(article=item_id)
-            return JsonResponse({'stock': item.count})
-        except Item.DoesNotExist:
+        state = get_item_states([item_id]).get(item_id)
+        if state is None:
             return JsonResponse({'error': 'Товар не найден'}, status=404)
+        return JsonResponse({'stock': state['stock']})
     return JsonResponse({'error': 'Некорректный запрос'}, status=400)
 
 
+def booking_conflicts(state, start_date, end_date, exclude_booking=None):
+    """Approved bookings of the item overlapping the period, from a get_item_states state."""
+    periods = sorted({
+        (line_start, line_end)
+        for booking_id, line_start, line_end, count, is_approved in state['lines']
+        if is_approved and booking_id != exclude_booking and line_start <= end_date and line_end >= start_date
+    })
+    return [{"start_date": start, "end_date": end} for start, end in periods]
+
+
+@staff_member_required
 def check_item_booking(request, item_id, start_date, end_date):
-    item = get_object_or_404(Item, article=item_id)
-    active_bookings = ItemBooking.objects.filter(
-        items=item, 
-        is_approved=True, 
-        end_date__gte=start_date, 
-        start_date__lte=end_date
-    )
-
-    bookings_data = []
-    if active_bookings.exists():
-        for booking in active_bookings:
-            bookings_data.append({
-                "start_date": booking.start_date,
-                "end_date": booking.end_date,
-            })
-
-    return JsonResponse({"bookings": bookings_data})
+    try:
+        start_date = datetime.date.fromisoformat(start_date)
+        end_date = datetime.date.fromisoformat(end_date)
+        exclude_booking = int(request.GET['booking_id']) if request.GET.get('booking_id') else None
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный запрос'}, status=400)
+    if start_date > end_date:
+        return JsonResponse({'error': 'Некорректный период'}, status=400)
+    
+    states = get_item_states([item_id])
+    if not states:
+        raise Http404
+    state = states[item_id]
+    days = cached_available_quantities(states, start_date, end_date, exclude_booking)[item_id]
+    return JsonResponse({
+        "bookings": booking_conflicts(state, start_date, end_date, exclude_booking),
+        "available": min(days.values(), default=0),
+        "days": [{"date": day, "available": quantity} for day, quantity in days.items()],
+    })
+
+
+@staff_member_required
+def check_item_bookings(request):
+    """
+    Остатки, доступность и пересекающиеся брони сразу для многих товаров:
+    ?item_id=...&item_id=...&start_date=YYYY-MM-DD&end_date=YYYY-MM-DD[&booking_id=]
+    """
+    articles = list(dict.fromkeys(filter(None, request.GET.getlist('item_id'))))
+    try:
+        start_date = datetime.date.fromisoformat(request.GET.get('start_date', ''))
+        end_date = datetime.date.fromisoformat(request.GET.get('end_date', ''))
+        exclude_booking = int(request.GET['booking_id']) if request.GET.get('booking_id') else None
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный запрос'}, status=400)
+    if not articles or start_date > end_date:
+        return JsonResponse({'error': 'Некорректный запрос'}, status=400)
+    
+    states = get_item_states(articles)
+    available = cached_available_quantities(states, start_date, end_date, exclude_booking)
+    return JsonResponse({'items': {
+        article: {
+            'stock': state['stock'],
+            'available': min(available[article].values()),
+            'bookings': booking_conflicts(state, start_date, end_date, exclude_booking),
+        }
+        for article, state in states.items()
+    }})
+
+
+@staff_member_required
+def stock_as_of(request, date):
+    """
+    Остаток товара (?item_id=) на конец дня `date`.
+    Перемещения между складами не хранятся, поэтому остатки склада на дату
+    не вычисляются (?storage_id= отклоняется); склад в ответе - текущий склад товара.
+    """
+    try:
+        day = datetime.date.fromisoformat(date)
+    except ValueError:
+        return JsonResponse({'error': 'Некорректная дата'}, status=400)
+    
+    if 'storage_id' in request.GET:
+        if not request.GET['storage_id'].isdigit():
+            return JsonResponse({'error': 'Некорректный запрос'}, status=400)
+        return JsonResponse({'error': 'Остатки склада на дату недоступны: перемещения между складами не хранятся'}, status=400)
+    if not request.GET.get('item_id'):
+        return JsonResponse({'error': 'Некорректный запрос'}, status=400)
+    items = Item.objects.filter(article=request.GET['item_id'])
+    
+    stocks = with_stock_as_of(items, day).values_list('article', 'name', 'storage__name', 'stock_as_of')
+    return JsonResponse({
+        'date': day,
+        'items': [
+            {'article': article, 'name': name, 'current_storage': storage, 'stock': stock}
+            for article, name, storage, stock in stocks
+        ],
+    })
+
+
+@staff_member_required
+def download_export(request, job_id):
+    jobs = ExportJob.objects.filter(status="done")
+    if not request.user.is_superuser:
+        jobs = jobs.filter(user=request.user)
+    job = get_object_or_404(jobs, pk=job_id)
+    return FileResponse(job.file.open("rb"), as_attachment=True, filename=job.file.name.rsplit("/", 1)[-1])
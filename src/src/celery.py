@@ -13,9 +13,17 @@ app.autodiscover_tasks()
 
 app.conf.update(
     CELERYBEAT_SCHEDULE={
-        "archive_expired_bookings": {
-            "task": "base.tasks.archive_expired_bookings",
+        "close_expired_bookings": {
+            "task": "base.tasks.close_expired_bookings",
             "schedule": crontab(),
-        }
+        },
+        "snapshot_stock_balances": {
+            "task": "base.tasks.snapshot_stock_balances",
+            "schedule": crontab(hour=0, minute=15),
+        },
+        "rebuild_storage_occupancy": {
+            "task": "base.tasks.rebuild_storage_occupancy",
+            "schedule": crontab(hour=0, minute=30),
+        },
     }
 )
\ No newline at end of file
@@ -32,6 +32,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     # Libs
     "admin_extra_buttons",
     "django_celery_beat",
@@ -149,6 +150,17 @@ STATICFILES_DIRS = [
 MEDIA_ROOT = BASE_DIR / "media"
 MEDIA_URL = "/media/"
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://redis:6379/1",
+    }
+}
+
+# Кэш выгрузок (LRU по времени последнего обращения)
+EXPORT_CACHE_ROOT = MEDIA_ROOT / "exports" / "cache"
+EXPORT_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
 # Брокер сообщений для Celery (Redis)
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 
@@ -19,13 +19,16 @@ from django.contrib import admin
 from django.conf import settings
 from django.conf.urls.static import static
 
-from base.views import get_item_booking, check_item_booking
+from base.views import get_item_booking, check_item_booking, check_item_bookings, download_export, stock_as_of
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('utils/get_item_booking/', get_item_booking, name='get_item_booking'),
-    path('utils/check_item_booking/<int:item_id>/<str:start_date>/<str:end_date>/', check_item_booking, name='check_item_booking'),
+    path('utils/check_item_booking/<str:item_id>/<str:start_date>/<str:end_date>/', check_item_booking, name='check_item_booking'),
+    path('utils/check_item_bookings/', check_item_bookings, name='check_item_bookings'),
+    path('utils/stock_as_of/<str:date>/', stock_as_of, name='stock_as_of'),
+    path('utils/exports/<int:job_id>/download/', download_export, name='download_export'),
 ]
 
 if settings.DEBUG:
@@ -4,38 +4,83 @@ function formatDateToISO(dateString) {
     return `${year}-${month}-${day}`;
 }
 
-document.addEventListener('DOMContentLoaded', function () {
-    const itemSelectElements = document.querySelectorAll('select[name$="-item"]');
-    const startDateElement = document.querySelector('input[name="start_date"]');
-    const endDateElement = document.querySelector('input[name="end_date"]');
-
-    itemSelectElements.forEach(function (selectElement) {
-        selectElement.addEventListener('change', function () {
-            const itemId = this.value;
-            const startDate = formatDateToISO(startDateElement.value);
-            const endDate = formatDateToISO(endDateElement.value);
-
-            if (itemId && startDate && endDate) {
-                fetch(`/utils/check_item_booking/${itemId}/${startDate}/${endDate}/`)
-                    .then(response => response.json())
-                    .then(data => {
-                        let messageElement = document.getElementById(`booking-message-${itemId}`);
-                        if (!messageElement) {
-                            messageElement = document.createElement('div');
-                            messageElement.id = `booking-message-${itemId}`;
-                            this.parentNode.appendChild(messageElement);
-                        }
-
-                        if (data.bookings.length > 0) {
-                            let messages = data.bookings.map(
-                                booking => `Товар забронирован с ${booking.start_date} по ${booking.end_date}`
-                            ).join('<br>');
-                            messageElement.innerHTML = `<div style="color: red;">${messages}</div>`;
-                        } else {
-                            messageElement.innerHTML = '';
-                        }
-                    });
-            }
+(function($) {
+    const DEBOUNCE_MS = 300;
+    let timer = null;
+    let controller = null;
+
+    function itemSelects() {
+        // Пустая форма-шаблон инлайна (__prefix__) не учитывается
+        return $('select[name$="-item"]').not('[name*="__prefix__"]');
+    }
+
+    function messageElement(select) {
+        let element = $(select).siblings('.booking-message');
+        if (!element.length) {
+            element = $('<div class="booking-message"></div>');
+            $(select).parent().append(element);
+        }
+        return element;
+    }
+
+    function render(select, info) {
+        const element = messageElement(select);
+        if (!info) {
+            element.html('');
+            return;
+        }
+        const messages = info.bookings.map(
+            booking => `Товар забронирован с ${booking.start_date} по ${booking.end_date}`
+        );
+        messages.push(`Количество на складе: ${info.stock}`);
+        messages.push(`Доступно на период: ${Math.max(info.available, 0)}`);
+        element.html(`<div style="color: ${info.bookings.length > 0 ? 'red' : 'green'};">${messages.join('<br>')}</div>`);
+    }
+
+    function check() {
+        const startDate = $('input[name="start_date"]').val();
+        const endDate = $('input[name="end_date"]').val();
+        const selects = itemSelects().filter(function() { return this.value; });
+        if (!startDate || !endDate || !selects.length) {
+            return;
+        }
+
+        const params = new URLSearchParams({
+            start_date: formatDateToISO(startDate),
+            end_date: formatDateToISO(endDate),
         });
+        // На странице изменения брони её собственные позиции не учитываются
+        const bookingMatch = window.location.pathname.match(/\/(\d+)\/change\/$/);
+        if (bookingMatch) {
+            params.append('booking_id', bookingMatch[1]);
+        }
+        selects.each(function() { params.append('item_id', this.value); });
+
+        // Ответ на устаревший запрос не нужен
+        if (controller) {
+            controller.abort();
+        }
+        controller = new AbortController();
+        fetch(`/utils/check_item_bookings/?${params}`, {signal: controller.signal})
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    return;
+                }
+                selects.each(function() { render(this, data.items[this.value]); });
+            })
+            .catch(() => {});
+    }
+
+    function scheduleCheck() {
+        clearTimeout(timer);
+        timer = setTimeout(check, DEBOUNCE_MS);
+    }
+
+    $(document).ready(function() {
+        // Делегирование: работает и для строк, добавленных кнопкой «Добавить ещё»
+        $(document).on('change', 'select[name$="-item"], input[name="start_date"], input[name="end_date"]', scheduleCheck);
+        $(document).on('formset:added', scheduleCheck);
+        scheduleCheck();
     });
-});
\ No newline at end of file
+})(django.jQuery);